@@ -2,6 +2,9 @@ __author__ = 'Justin Pinkney'
 __version__ = '0.0'
 
 from jowr.core import *
+from jowr.cache import *
 from jowr.pipeline import *
 from jowr.readers import *
+from jowr.shared import *
+from jowr.sinks import *
 from jowr.calibration import *
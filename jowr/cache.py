@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+
+def hash_array(array):
+    """Return a hex digest of the shape, type and contents of an array."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Least recently used cache of arrays bounded by memory use.
+
+    The size of the cache is limited by the total number of bytes held rather
+    than the number of items, as arrays (e.g. frames at different
+    resolutions) vary in size. When the budget is exceeded the least recently
+    used items are evicted.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached arrays in bytes.
+
+    Attributes:
+        hits (int): Number of `get` calls that found the key.
+        misses (int): Number of `get` calls that did not find the key.
+        nbytes (int): Total size of the arrays currently cached.
+
+    Note:
+        Cached arrays are returned without copying, so they should be treated
+        as read-only.
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'LRUCache({} items, {}/{} bytes)'.format(len(self), self.nbytes,
+                                                        self.max_bytes)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Return the cached array for `key`, or `default` if not cached."""
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add an array to the cache, evicting old items if needed.
+
+        Arrays larger than the whole budget are not cached.
+        """
+        if value.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key).nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        """Remove all items and reset the counters."""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class ArrayCache:
+    """Cache of arrays in memory, optionally backed by a directory on disk.
+
+    Arrays are kept in an `LRUCache`, and if a directory is given also saved
+    there as .npy files, so they survive between sessions. Arrays found on
+    disk are moved back into memory when used.
+
+    Args:
+        max_bytes (int): Memory budget in bytes.
+        directory (Optional[str]): Directory for the on-disk tier, created if
+            it doesn't exist.
+
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.memory = LRUCache(max_bytes)
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return 'ArrayCache({}, {})'.format(self.memory, self.directory)
+
+    @property
+    def hits(self):
+        return self.memory.hits
+
+    @property
+    def misses(self):
+        return self.memory.misses
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key, default=None):
+        """Return the cached array for `key`, or `default` if not cached."""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.directory is not None:
+            try:
+                value = np.load(self._path(key))
+            except (OSError, ValueError):
+                return default
+            self.memory.put(key, value)
+            return value
+        return default
+
+    def put(self, key, value):
+        """Add an array to the cache."""
+        self.memory.put(key, value)
+        if self.directory is not None and not os.path.isfile(self._path(key)):
+            # Write to a temporary file first so a partly written file is
+            # never read
+            handle, temp_name = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+            with os.fdopen(handle, 'wb') as temp_file:
+                np.save(temp_file, value)
+            os.replace(temp_name, self._path(key))
+
+    def clear(self):
+        """Empty the memory tier, files on disk are kept."""
+        self.memory.clear()
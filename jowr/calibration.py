@@ -1,7 +1,10 @@
+import hashlib
 import os
 import zipfile
 import pickle
 import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import jowr
 import cv2
@@ -40,15 +43,31 @@ class Calibrator(object):
 
     def __init__(self,
                  chequer_size=(9, 6),
-                 chequer_scale=25.0):
+                 chequer_scale=25.0,
+                 pyramid_levels=0,
+                 subpix_window=None,
+                 detection_cache=False):
         """ Create the Calibrator object.
 
         Optionally specify the chequerboard size to be used. Download one here:
         http://docs.opencv.org/2.4/_downloads/pattern.png
 
+        For high resolution images, detection is faster and more reliable on
+        a downscaled image. Set `pyramid_levels` to search for the
+        chequerboard on an image halved in size that many times, the corners
+        found are then refined on the full resolution image.
+
         Args:
             chequer_size (Tuple[int]): The (columns, rows) of the chequerboard
             chequer_scale (int): The size of a square in mm
+            pyramid_levels (int): Number of times to halve the image size
+                before searching for the chequerboard
+            subpix_window (Optional[Tuple[int]]): Half size of the search
+                window used to refine corners at full resolution, by default
+                large enough to cover the error of the downscaled search
+            detection_cache (bool): Save the corners detected in each image
+                of a zipfile or directory next to it, so calibrating from the
+                same images again skips detection
         """
 
         # TODO show result option
@@ -61,11 +80,15 @@ class Calibrator(object):
 
         self.chequer_size = chequer_size
         self.chequer_scale = chequer_scale
+        self.pyramid_levels = pyramid_levels
+        self.subpix_window = subpix_window
+        self.detection_cache = detection_cache
+        self.detections = None  # Cached detections of the current source
 
         self.chequer_points = self.generate_chequer_points(self.chequer_size,
                                                            self.chequer_scale)
 
-    def calibrate(self, cam, save_name=''):
+    def calibrate(self, cam, save_name='', workers=1):
         """ Calibrate a camera, video, zipfile, or directory of images.
 
         Args:
@@ -73,6 +96,8 @@ class Calibrator(object):
                 to a zipfile, or a directory.
             save_name (Optional[str]): Path to zipfile to save images. If empty
                 no images are saved.
+            workers (Optional[int]): Number of threads detecting chequerboards
+                in a zipfile or directory of images.
         """
         # A camera/video
         # TODO think about a consistent interface to image collections
@@ -80,10 +105,10 @@ class Calibrator(object):
             self.calibrate_reader(cam, save_name)
         # An existing zip file of images
         elif zipfile.is_zipfile(cam):
-            self.calibrate_zip(cam)
+            self.calibrate_zip(cam, workers)
         # An existing folder of images
         elif os.path.isdir(cam):
-            self.calibrate_folder(cam)
+            self.calibrate_folder(cam, workers)
         # I don't know what this is
         else:
             raise TypeError("Unknown input type, "
@@ -91,36 +116,31 @@ class Calibrator(object):
 
         return self.calibration
 
-    def calibrate_zip(self, cam):
-        """ Calibrate all the png files in a zip archive.
+    def calibrate_zip(self, cam, workers=1):
+        """ Calibrate all the images in a zip archive.
+
+        Images are decoded directly from the zip file, without extracting
+        them.
 
         Args:
             cam (str): Path to the zipfile.
+            workers (Optional[int]): Number of threads detecting
+                chequerboards.
 
         """
-        with zipfile.ZipFile(cam, 'r') as zip_file:
-            zip_members = [f.filename for f in zip_file.filelist]
-            # TODO add other extension
-            is_png = [this_file.endswith('.png')
-                      for this_file in zip_members]
-
-            # Check there are some png files
-            if not any(is_png):
-                raise TypeError("No png files found in zip")
-
-            # Loop over files in zip file
-            for zipinfo, filename, png in \
-                    zip(zip_file.filelist, zip_members, is_png):
-                if png:
-                    # cv2's imread expect a file, so we extract
-                    zip_file.extract(zipinfo)
-                    image = cv2.imread(filename)
-                    # TODO be careful here!
-                    os.remove(filename)
-                    self.check_resolution(image)
-                    self.process(image, '')
-
-            self.calculate_calibration()
+        images = jowr.ZipImages(cam)
+        # Check there are some image files
+        if not len(images):
+            raise TypeError("No image files found in zip")
+        self.load_detections(cam)
+        try:
+            with images.open_frames() as frames:
+                self.process_images(frames, workers)
+            self.save_detections(cam)
+        finally:
+            # Only cache detections for this zipfile
+            self.detections = None
+        self.calculate_calibration()
 
     def calibrate_reader(self, reader, save_name):
         """ Calibrate images selected from a camera or video.
@@ -132,35 +152,82 @@ class Calibrator(object):
         """
         print("Press s key to capture an image. Press Esc to finish.")
         self.resolution = reader.resolution
-        with reader.open_frames() as frames:
-            for frame in frames():
-                # Detect corners for each image during acquisition
-                stop = jowr.show(frame, 'Camera',
-                                 wait_time=1,
-                                 callbacks={
-                                     # Process a frame on s key pressed
-                                     's': lambda: self.process(frame,
-                                                               save_name)
-                                 },
-                                 auto_close=False)
-                if stop:
-                    break
-            self.calculate_calibration()
-
-    def calibrate_folder(self, folder):
+        # Keep the zip file open, saving images on a background thread
+        archive = jowr.ZipSink(save_name) if save_name else None
+        try:
+            with reader.open_frames() as frames:
+                for frame in frames:
+                    # Detect corners for each image during acquisition
+                    stop = jowr.show(frame, 'Camera',
+                                     wait_time=1,
+                                     callbacks={
+                                         # Process a frame on s key pressed
+                                         's': lambda: self.process(frame,
+                                                                   archive)
+                                     },
+                                     auto_close=False)
+                    if stop:
+                        break
+        finally:
+            if archive is not None:
+                archive.close()
+        self.calculate_calibration()
+
+    def calibrate_folder(self, folder, workers=1):
         """ Calibrate all the png files in a directory.
 
         Args:
             folder (str): directory to search for images (not including
                 subdirectories).
+            workers (Optional[int]): Number of threads detecting
+                chequerboards.
 
         """
-        for filename in jowr.find_images(folder):
-            image = cv2.imread(filename)
-            self.check_resolution(image)
-            self.process(image, '')
+        sequence = jowr.ImageSequence(folder)
+        self.load_detections(folder)
+        try:
+            with sequence.open_frames() as frames:
+                self.process_images(frames, workers)
+            self.save_detections(folder)
+        finally:
+            # Only cache detections for this directory
+            self.detections = None
         self.calculate_calibration()
 
+    def process_images(self, images, workers=1):
+        """ Find the chessboard corners in a sequence of images.
+
+        With more than one worker, corners are detected on a pool of threads
+        (OpenCV releases the GIL while detecting), but the results are still
+        added in the order of the images so the calibration is the same.
+
+        Args:
+            images: Iterable of images.
+            workers (Optional[int]): Number of threads detecting
+                chequerboards.
+
+        """
+        if workers <= 1:
+            for image in images:
+                self.check_resolution(image)
+                self.process(image, '')
+            return
+
+        def add_next():
+            image, detection = pending.popleft()
+            self.add_corners(image, detection.result())
+
+        with ThreadPoolExecutor(workers) as executor:
+            # Bound the number of images held in memory at once
+            pending = deque()
+            for image in images:
+                self.check_resolution(image)
+                if len(pending) >= 2 * workers:
+                    add_next()
+                pending.append((image, executor.submit(self.detect, image)))
+            while pending:
+                add_next()
+
     def save(self, filename):
         """ Save the current calibration to a file.
 
@@ -193,19 +260,93 @@ class Calibrator(object):
 
         Args:
             frame Colour image with channel ordering BGR
-             save_name Name of zip file to save image to
+             save_name Name of zip file, or a jowr.Sink, to save image to
         """
-        if jowr.channels(frame) is 3:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = frame.copy()
+        return self.add_corners(frame, self.detect(frame), save_name)
+
+    def detect(self, frame):
+        """ Detect the chessboard corners in an image.
+
+        This only depends on the detection settings, so it is safe to call
+        from several threads at once.
+
+        Args:
+            frame Colour image with channel ordering BGR, or grayscale
 
-        # Find the chess board corners
-        ret, corners = \
-            cv2.findChessboardCorners(gray,
-                                      (self.chequer_size[0],
-                                       self.chequer_size[1]),
-                                      cv2.CALIB_CB_FAST_CHECK)
+        Returns:
+            The corner positions, or None if the chessboard was not found.
+        """
+        if self.detections is None:
+            return find_chequerboard(frame, self.chequer_size,
+                                     self.pyramid_levels, self.subpix_window)
+
+        settings = repr((tuple(self.chequer_size), self.pyramid_levels,
+                         self.subpix_window))
+        key = '{}-{}'.format(jowr.hash_array(frame),
+                             hashlib.blake2b(settings.encode(),
+                                             digest_size=8).hexdigest())
+        if key not in self.detections:
+            self.detections[key] = find_chequerboard(frame, self.chequer_size,
+                                                     self.pyramid_levels,
+                                                     self.subpix_window)
+        return self.detections[key]
+
+    @staticmethod
+    def detections_path(source):
+        """ Path of the detection cache for a zipfile or directory."""
+        if os.path.isdir(source):
+            return os.path.join(source, '.jowr_corners.npz')
+        return source + '.corners.npz'
+
+    def load_detections(self, source):
+        """ Load the cached detections for a zipfile or directory.
+
+        Detections are keyed by a hash of the image contents and the
+        detection settings. Does nothing unless `detection_cache` is set.
+
+        The cache only holds arrays and is loaded without unpickling, so
+        caches in downloaded or shared folders can't run code.
+
+        Args:
+            source (str): Path to the zipfile or directory.
+        """
+        self.detections = None
+        if not self.detection_cache:
+            return
+        self.detections = {}
+        try:
+            with np.load(self.detections_path(source),
+                         allow_pickle=False) as cache_file:
+                for key in cache_file.files:
+                    corners = cache_file[key]
+                    # Images without a chessboard are stored as empty arrays
+                    self.detections[key] = corners if corners.size else None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            self.detections = {}
+
+    def save_detections(self, source):
+        """ Save the detections for a zipfile or directory to its cache."""
+        if self.detections is None:
+            return
+        arrays = {key: np.zeros((0, 1, 2), np.float32) if corners is None
+                  else corners
+                  for key, corners in self.detections.items()}
+        try:
+            with open(self.detections_path(source), 'wb') as cache_file:
+                np.savez(cache_file, **arrays)
+        except OSError:
+            # Not being able to cache the detections is not fatal
+            pass
+
+    def add_corners(self, frame, corners, save_name=''):
+        """ Add the corners detected in an image to the calibration data.
+
+        Args:
+            frame Colour image with channel ordering BGR
+            corners Corners found by `detect`, or None if not found
+            save_name Name of zip file, or a jowr.Sink, to save image to
+        """
+        ret = corners is not None
 
         # If found, add object points, image points (after refining them)
         if not ret:
@@ -225,7 +366,9 @@ class Calibrator(object):
                           window_name='Detected_corners',
                           wait_time=500)
 
-            if save_name:
+            if isinstance(save_name, jowr.Sink):
+                save_name.write(frame)
+            elif save_name:
                 # Add to the zip file
                 jowr.add_to_zip(frame, save_name)
         return ret
@@ -278,7 +421,55 @@ class Calibrator(object):
         return chequer_points
 
 
+def find_chequerboard(image, chequer_size, pyramid_levels=0,
+                      subpix_window=None):
+    """Find the corners of a chequerboard in an image.
+
+    Args:
+        image: Colour image with channel ordering BGR, or grayscale.
+        chequer_size (Tuple[int]): The (columns, rows) of the chequerboard.
+        pyramid_levels (int): Number of times to halve the image size before
+            searching. Corners found on the smaller image are refined with
+            `cv2.cornerSubPix` on the full resolution image.
+        subpix_window (Optional[Tuple[int]]): Half size of the refinement
+            window, by default 2 ** pyramid_levels + 2.
+
+    Returns:
+        The corner positions, or None if the chequerboard was not found.
+    """
+    if jowr.channels(image) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+
+    small = gray
+    for _ in range(pyramid_levels):
+        small = cv2.pyrDown(small)
+
+    ret, corners = cv2.findChessboardCorners(small,
+                                             (chequer_size[0],
+                                              chequer_size[1]),
+                                             cv2.CALIB_CB_FAST_CHECK)
+    if not ret:
+        return None
+
+    if pyramid_levels:
+        scale = 2 ** pyramid_levels
+        if subpix_window is None:
+            subpix_window = (scale + 2, scale + 2)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                    30, 0.01)
+        corners = cv2.cornerSubPix(gray, corners * scale, subpix_window,
+                                   (-1, -1), criteria)
+    return corners
+
+
 def undistort(frame, calibration):
+    """Remove lens distortion from a single frame.
+
+    This recomputes the undistortion for every call, to undistort many frames
+    use an `Undistorter`.
+    """
     if not jowr.resolution(frame) == calibration['resolution']:
         raise ValueError("Resolution of image not equal to that of calibration")
     return cv2.undistort(frame,
@@ -286,6 +477,120 @@ def undistort(frame, calibration):
                          calibration['distortion'])
 
 
+class Undistorter(object):
+    """ Removes lens distortion using precomputed maps.
+
+    `cv2.undistort` works out where every pixel comes from each time it is
+    called. An Undistorter computes this mapping once per resolution with
+    `cv2.initUndistortRectifyMap`, then undistorts each frame with the much
+    cheaper `cv2.remap`. Frames of a different resolution to the calibration
+    (with the same aspect ratio, e.g. a camera in a lower resolution mode)
+    use a camera matrix scaled to their size.
+
+    Undistorter objects are callable, so can be added directly to a
+    `jowr.Pipeline`.
+
+    Examples:
+
+        >>> undistorter = jowr.Undistorter(calibration)
+        >>> pipeline = jowr.Pipeline()
+        >>> pipeline.add_step(undistorter, 'undistort', accepts_out=True)
+
+        Or as a batch step:
+
+        >>> pipeline.add_step(undistorter.undistort_batch, 'undistort',
+        ...                   batch_size=8)
+
+    """
+
+    def __init__(self, calibration, alpha=None, fixed_point=True,
+                 interpolation=cv2.INTER_LINEAR):
+        """ Create the Undistorter.
+
+        Args:
+            calibration (dict): Calibration from a `Calibrator`.
+            alpha (Optional[float]): Free scaling between 0 (only valid pixels
+                are kept) and 1 (all source pixels are kept), see
+                `cv2.getOptimalNewCameraMatrix`. By default the camera matrix
+                is unchanged, as with `undistort`.
+            fixed_point (bool): Use compact fixed point maps (`cv2.CV_16SC2`),
+                which are faster to remap with than floating point maps at a
+                small cost in precision.
+            interpolation (int): OpenCV interpolation flag used to remap.
+        """
+        self.calibration = calibration
+        self.alpha = alpha
+        self.fixed_point = fixed_point
+        self.interpolation = interpolation
+        self._maps = {}
+
+    def maps(self, resolution, alpha=None):
+        """ Return the undistortion maps for a resolution.
+
+        Maps are computed the first time a resolution and alpha is used and
+        cached after that.
+
+        Args:
+            resolution (Tuple[int]): (width, height) of the frames.
+            alpha (Optional[float]): Overrides the `alpha` of the
+                Undistorter.
+        """
+        alpha = self.alpha if alpha is None else alpha
+        key = (tuple(resolution), alpha)
+        maps = self._maps.get(key)
+        if maps is None:
+            matrix = self.calibration['matrix'].copy()
+            distortion = self.calibration['distortion']
+            calibration_resolution = self.calibration['resolution']
+            # Scale the camera matrix to the frame size
+            matrix[0] *= resolution[0] / calibration_resolution[0]
+            matrix[1] *= resolution[1] / calibration_resolution[1]
+            if alpha is None:
+                new_matrix = matrix
+            else:
+                new_matrix, _ = cv2.getOptimalNewCameraMatrix(
+                    matrix, distortion, tuple(resolution), alpha)
+            map_type = cv2.CV_16SC2 if self.fixed_point else cv2.CV_32FC1
+            maps = cv2.initUndistortRectifyMap(matrix, distortion, None,
+                                               new_matrix, tuple(resolution),
+                                               map_type)
+            self._maps[key] = maps
+        return maps
+
+    def __call__(self, frame, out=None):
+        """ Undistort a frame, or a batch of frames.
+
+        Args:
+            frame (np.ndarray): Image, or a 4 dimensional (N, H, W, C) array
+                of images. Use `undistort_batch` for batches of grayscale
+                images.
+            out (Optional[np.ndarray]): Array of the same shape and type to
+                write the result into.
+        """
+        if frame.ndim == 4:
+            return self.undistort_batch(frame, out)
+        map1, map2 = self.maps(jowr.resolution(frame))
+        return cv2.remap(frame, map1, map2, self.interpolation, dst=out)
+
+    def undistort_batch(self, frames, out=None):
+        """ Undistort a batch of frames of the same size.
+
+        Suitable for a batch step of a `jowr.Pipeline`, e.g.
+        ``pipeline.add_step(undistorter.undistort_batch, batch_size=8)``.
+
+        Args:
+            frames (np.ndarray): (N, H, W) or (N, H, W, C) array of images.
+            out (Optional[np.ndarray]): Array of the same shape and type to
+                write the result into.
+        """
+        if out is None:
+            out = np.empty_like(frames)
+        map1, map2 = self.maps(jowr.resolution(frames[0]))
+        for frame, frame_out in zip(frames, out):
+            cv2.remap(frame, map1, map2, self.interpolation, dst=frame_out)
+        return out
+
+
 if __name__ == '__main__':
     reader = jowr.Camera(0)
 
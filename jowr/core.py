@@ -4,11 +4,15 @@ import zipfile
 import datetime
 import numpy as np
 import glob
+import queue
+import re
 
 # Constants
 DEFAULT_WINDOW_NAME = "default"
 ESC_CODE = 27
 """Key code for Esc """
+IMAGE_EXTENSIONS = ('.tiff', '.tif', '.png', '.jpg', '.jpeg', '.bmp')
+"""File extensions of the image types searched for by `find_images`"""
 
 
 def show(frame, window_name=DEFAULT_WINDOW_NAME, wait_time=0, callbacks=None,
@@ -50,17 +54,33 @@ def im_read_resize(filename, new_width=0, new_height=0):
 
 
 def add_to_zip(image, filename):
-    """ Add an image to zip file with datestamp."""
+    """ Add an image to zip file with datestamp.
+
+    The image is encoded in memory and named by the current time to the
+    microsecond. To add many images, `jowr.ZipSink` keeps the zip file open
+    and encodes on a background thread.
+    """
+    success, encoded = cv2.imencode('.png', image)
+    if not success:
+        raise IOError("Could not encode image")
     with zipfile.ZipFile(filename, 'a') as zip_file:
-        # Make the filename
-        temp_filename = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')\
-                        + ".png"
-        # Write image
-        cv2.imwrite(temp_filename, image)
-        # Add to zip
-        zip_file.write(temp_filename)
-        # Delete the temporary file
-        os.remove(temp_filename)
+        name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f') + ".png"
+        name = unique_name(name, set(zip_file.namelist()))
+        zip_file.writestr(name, encoded.tobytes())
+
+
+def unique_name(name, names):
+    """Return `name`, with a counter added if it is already in `names`.
+
+    The returned name is added to `names`.
+    """
+    stem, extension = os.path.splitext(name)
+    count = 1
+    while name in names:
+        name = '{}-{}{}'.format(stem, count, extension)
+        count += 1
+    names.add(name)
+    return name
 
 
 def resolution(image):
@@ -88,11 +108,34 @@ def channels(image):
 
 def find_images(folder):
     """Find all image types in a folder."""
-    image_types = ('.tiff', '.tif', '.png', 'jpg', 'jpeg', 'bmp')
     images = []
-    for image_type in image_types:
+    for image_type in IMAGE_EXTENSIONS:
         images.extend(glob.glob(os.path.join(folder, '*' + image_type)))
     return images
 
+
+def natural_sort_key(text):
+    """Key to sort strings with embedded numbers in numerical order.
+
+    For example 'frame2.png' sorts before 'frame10.png'.
+    """
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r'(\d+)', text)]
+
 def scale(image, scale):
-    return cv2.resize(image, None, fx=scale, fy=scale)
\ No newline at end of file
+    return cv2.resize(image, None, fx=scale, fy=scale)
+
+
+def _put(target_queue, item, stopped):
+    """Put an item on a bounded queue, giving up if `stopped` is set.
+
+    Returns:
+        bool: True if the item was put on the queue.
+    """
+    while not stopped.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
@@ -1,4 +1,19 @@
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import types
+
+import numpy as np
+
 from . import core
+from .cache import ArrayCache, hash_array
+from .shared import attach, SharedFrame, SharedFramePool
 
 class Pipeline:
     """Applies a series of image processing functions on an image.
@@ -10,12 +25,46 @@ class Pipeline:
     Attributes:
         steps: A list of the image processing functions to be applied
         labels: A list of strings describing each step in the pipeline
+        workers: A list of the number of threads used by each step when
+            streaming
+        batch_sizes: A list of the maximum batch size of each step, 0 for
+            steps which take a single image
+        max_latencies: A list of the time in seconds each batch step waits
+            to fill a batch when streaming
+        profile: The `PipelineProfile` recording each step, None if
+            profiling is disabled
+        versions: A list of the version of each step, used to identify the
+            step's results when caching
+        cache: The `ArrayCache` of step results, None if caching is disabled
+        accepts_out: A list of whether each step takes an `out` argument
+        reuse_buffers: If True, `run` passes steps which accept an `out`
+            argument a reusable buffer to write their result into
 
     """
 
     def __init__(self):
         self.steps = []
         self.labels = []
+        self.workers = []
+        self.batch_sizes = []
+        self.max_latencies = []
+        self.versions = []
+        self.accepts_out = []
+        self.profile = None
+        self.cache = None
+        self.reuse_buffers = False
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Caches and buffers belong to the process that made them
+        state = self.__dict__.copy()
+        state['cache'] = None
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
 
     def __repr__(self):
         return_string = "A jowr Pipeline object with %d steps" % len(self.steps)
@@ -25,32 +74,804 @@ class Pipeline:
                 return_string += '\t' + label + '\n'
         return return_string
 
-    def add_step(self, func, label=''):
+    def add_step(self, func, label='', workers=1, batch_size=0,
+                 max_latency=0.05, version=None, accepts_out=False):
         """Add a step to the Pipeline.
 
-        Note: Func should take as input, and return, a single image
+        Note: Func should take as input, and return, a single image, unless
+        `batch_size` is given, in which case it should take and return a stack
+        of images of shape (N, H, W, C).
 
         Args:
             func: The function to apply in the image processing step
             label: String label to describe func
+            workers: Number of threads running this step when streaming, see
+                `stream`
+            batch_size: If greater than 0, the step is applied to batches of
+                up to this many images when streaming. Outside of `stream`
+                the step is applied to batches of a single image.
+            max_latency: Maximum time in seconds to wait for more images to
+                fill a batch when streaming.
+            version: Any value identifying the version of func, change it to
+                invalidate cached results of the step (see `enable_cache`).
+            accepts_out: True if func takes an optional `out` argument, an
+                array of the same shape and type as its input to write the
+                result into (see `reuse_buffers`). func must also work when
+                `out` is not given.
 
         """
         if not callable(func):
             raise TypeError("Pipeline step should be a callable function")
+        if workers < 1:
+            raise ValueError("A step needs at least one worker")
 
         self.steps.append(func)
+        self.workers.append(workers)
+        self.batch_sizes.append(batch_size)
+        self.max_latencies.append(max_latency)
+        self.versions.append(version)
+        self.accepts_out.append(accepts_out)
         if label:
             self.labels.append(label)
         else:
             self.labels.append('Step ' + str(len(self.steps)))
 
     def run(self, image):
-        """Run the Pipeline."""
-        for step in self.steps:
-            image = step(image)
+        """Run the Pipeline and return the result.
+
+        Note:
+            With `reuse_buffers` set, the result may be one of the Pipeline's
+            buffers, which is overwritten by the next call to `run` on the
+            same thread. Copy it if it needs to be kept.
+
+        """
+        buffers = self._thread_buffers() if self.reuse_buffers else None
+        if self.cache is not None:
+            return self._run_cached(image, buffers)
+        if self.profile is None and buffers is None:
+            for step, batch_size in zip(self.steps, self.batch_sizes):
+                if batch_size:
+                    image = step(image[np.newaxis])[0]
+                else:
+                    image = step(image)
+            return image
+        for index in range(len(self.steps)):
+            image = self._call_step(index, image, buffers)
+        return image
+
+    def _run_copy(self, image):
+        """Run the Pipeline, copying a result held in a reused buffer."""
+        result = self.run(image)
+        buffers = self._thread_buffers()
+        if isinstance(result, np.ndarray) and buffers.holds(result):
+            result = result.copy()
+        return result
+
+    def _thread_buffers(self):
+        """Return the buffers for `run` calls on the current thread."""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = _PingPongBuffers()
+        return buffers
+
+    def _call_step(self, index, image, buffers=None):
+        """Apply a single step, recording it if profiling.
+
+        If `buffers` are given and the step accepts an `out` argument, the
+        result is written into one of the buffers.
+        """
+        if self.batch_sizes[index]:
+            return self._call_batch(index, [image])[0]
+        kwargs = {}
+        if buffers is not None and self.accepts_out[index] and \
+                isinstance(image, np.ndarray):
+            kwargs['out'] = buffers.get(image)
+        if self.profile is None:
+            return self.steps[index](image, **kwargs)
+        start = time.perf_counter()
+        image = self.steps[index](image, **kwargs)
+        self.profile.record(index, start, time.perf_counter(), image)
+        return image
+
+    def _call_batch(self, index, images):
+        """Apply a batch step to a list of images, returning a list."""
+        batch = np.stack(images)
+        start = time.perf_counter()
+        batch = self.steps[index](batch)
+        if self.profile is not None:
+            self.profile.record(index, start, time.perf_counter(), batch)
+        return list(batch)
+
+    def _run_cached(self, image, buffers=None):
+        """Run the Pipeline, reusing cached results of the steps."""
+        # The key of each step's result depends on the input and every step
+        # up to it, so only the input image needs hashing. If one of
+        # the steps can't be identified the results from it on aren't cached.
+        keys = []
+        key = hash_array(image)
+        for index in range(len(self.steps)):
+            identity = self._step_identity(index)
+            if key is not None and identity is not None:
+                key = hashlib.blake2b((key + identity).encode(),
+                                      digest_size=20).hexdigest()
+            else:
+                key = None
+            keys.append(key)
+
+        # Start after the last step with a cached result
+        start = 0
+        for index in reversed(range(len(self.steps))):
+            if keys[index] is None:
+                continue
+            cached = self.cache.get(keys[index])
+            if cached is not None:
+                image = cached.copy()
+                start = index + 1
+                break
+
+        for index in range(start, len(self.steps)):
+            image = self._call_step(index, image, buffers)
+            if keys[index] is not None and isinstance(image, np.ndarray):
+                self.cache.put(keys[index], image.copy())
+        return image
+
+    def _step_identity(self, index):
+        """Return a string identifying a step, for caching its results.
+
+        Returns None if the step can't be identified and has no version.
+        """
+        identity = _func_identity(self.steps[index])
+        if identity is None:
+            if self.versions[index] is None:
+                return None
+            identity = _qualified_name(type(self.steps[index]))
+        return '{}|{}|{!r}'.format(self.labels[index], identity,
+                                   self.versions[index])
+
+    def enable_cache(self, max_bytes=2**30, directory=None):
+        """Cache the result of each step of `run`.
+
+        Results are keyed on a hash of the input image and the identity of
+        each step up to and including the one producing it: its label, the
+        function's name and compiled code, its state (default arguments,
+        closure variables, or the public attributes of a callable object or
+        bound method's object) and its `version`. Running the
+        Pipeline again on the same image after changing only the last steps
+        reuses the cached results of the earlier steps.
+
+        Args:
+            max_bytes (int): Memory budget for the cached results.
+            directory (Optional[str]): Directory to also save results in, so
+                they are kept between sessions.
+
+        Returns:
+            ArrayCache: The new cache, also available as `cache`.
+
+        Note:
+            Steps are assumed to be deterministic. If a step depends on
+            anything other than its input image, code and state (e.g. a
+            global setting), pass a `version` to `add_step` which reflects
+            it. Results of steps whose state can't be identified, and the
+            steps after them, aren't cached unless the step has a `version`.
+
+        """
+        self.cache = ArrayCache(max_bytes, directory)
+        return self.cache
+
+    def disable_cache(self):
+        """Stop caching step results."""
+        self.cache = None
+
+    def enable_profiling(self):
+        """Start recording the time taken and output of each step.
+
+        Returns:
+            PipelineProfile: The new profile, also available as `profile`.
+
+        Note:
+            Steps run in other processes (the 'process' backend of `map`)
+            are not recorded.
+
+        """
+        self.profile = PipelineProfile(self.labels)
+        return self.profile
+
+    def disable_profiling(self):
+        """Stop recording, returning the profile recorded so far."""
+        profile, self.profile = self.profile, None
+        return profile
+
+    def map(self, frames, workers=None, backend='thread', max_in_flight=None,
+            shared_memory=False):
+        """Run the Pipeline over each of a sequence of frames in parallel.
+
+        Frames are processed by a pool of workers and the results are yielded
+        in the same order as the input frames. The number of frames submitted
+        but not yet yielded is bounded, so memory use stays flat however long
+        the input is.
+
+        Args:
+            frames: Iterable of images, e.g. a `Frames` object.
+            workers (Optional[int]): Number of workers, defaults to the number
+                of CPUs.
+            backend (str): 'thread' to use a thread pool (OpenCV functions
+                release the GIL), or 'process' to use a process pool, in which
+                case the steps must be picklable.
+            max_in_flight (Optional[int]): Maximum number of frames being
+                processed at once, defaults to twice the number of workers.
+            shared_memory (bool): With the 'process' backend, pass frames to
+                and from the workers through a `SharedFramePool` instead of
+                pickling them. Results with the same shape and type as the
+                input are returned through the same slot.
+
+        Yields:
+            The result of the Pipeline for each frame.
+
+        Note:
+            Frames from a reader reusing buffers (see `Capture.open_frames`)
+            must have more buffers than `max_in_flight`.
+
+        """
+        workers = workers or os.cpu_count()
+        max_in_flight = max_in_flight or 2 * workers
+        if backend == 'thread':
+            executor = ThreadPoolExecutor(workers)
+            run = self._run_copy if self.reuse_buffers else self.run
+        elif backend == 'process':
+            # Send the Pipeline to each worker once, not with every frame
+            executor = ProcessPoolExecutor(workers,
+                                           initializer=_set_worker_pipeline,
+                                           initargs=(self,))
+            run = _run_worker_pipeline
+        else:
+            raise ValueError("Unknown backend {}, "
+                             "should be 'thread' or 'process'".format(backend))
+        use_pool = shared_memory and backend == 'process'
+        pool = None
+
+        def finish(future, handle):
+            result = future.result()
+            if handle is None:
+                return result
+            if isinstance(result, SharedFrame):
+                # Copy out, the slot is about to be reused
+                result = pool.view(result).copy()
+            pool.release(handle)
+            return result
+
+        pending = deque()
+        try:
+            for frame in frames:
+                if len(pending) >= max_in_flight:
+                    yield finish(*pending.popleft())
+                if use_pool and pool is None:
+                    pool = SharedFramePool(frame.shape, frame.dtype,
+                                           max_in_flight)
+                if use_pool and pool.fits(frame):
+                    handle = pool.put(frame)
+                    pending.append((executor.submit(_run_worker_shared,
+                                                    handle), handle))
+                else:
+                    pending.append((executor.submit(run, frame), None))
+            while pending:
+                yield finish(*pending.popleft())
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if pool is not None:
+                pool.close()
+
+    def stream(self, frames, queue_size=4):
+        """Run the Pipeline over a sequence of frames, one stage per step.
+
+        Each step runs as its own stage on `workers` threads (set in
+        `add_step`), with a bounded queue between stages. Different steps
+        therefore work on different frames at the same time, so throughput
+        approaches that of the slowest stage rather than that of all the steps
+        added together. When a queue is full the stage feeding it waits,
+        keeping the number of frames in flight bounded. Giving a slow step more
+        workers increases the throughput of its stage.
+
+        Steps added with a `batch_size` collect frames from their queue into
+        batches, waiting at most `max_latency` for a batch to fill, and the
+        results are split back into single frames for the next stage. A batch
+        is also cut short when a frame of a different shape or type arrives.
+
+        Args:
+            frames: Iterable of images, e.g. a `Frames` object.
+            queue_size (int): Maximum number of frames waiting between stages.
+
+        Yields:
+            The result of the Pipeline for each frame, in the same order as
+            the input frames.
+
+        """
+        stages = _Stages(self, frames, queue_size)
+        try:
+            yield from stages
+        finally:
+            stages.close()
+
+    def write(self, frames, sink, **kwargs):
+        """Run the Pipeline over a sequence of frames into a sink.
+
+        Frames are processed with `stream` and the results written to the
+        sink, which encodes them on its own thread. Decoding (e.g. with a
+        prefetching reader), processing and encoding therefore all overlap.
+        The sink is closed once all the frames are written.
+
+        Args:
+            frames: Iterable of images, e.g. a `Frames` object.
+            sink (jowr.Sink): Where to write the results, e.g. a
+                `jowr.VideoSink`.
+            **kwargs: Passed to `stream`.
+
+        Returns:
+            int: The number of frames written.
+
+        """
+        with sink:
+            for image in self.stream(frames, **kwargs):
+                sink.write(image)
+        return sink.frames_written
 
     def run_and_show(self, image):
         """Run the Pipeline and display each step."""
-        for step, label in zip(self.steps, self.labels):
-            image = step(image)
+        for index, label in enumerate(self.labels):
+            image = self._call_step(index, image)
             core.show(image, window_name=label)
+
+
+def _func_identity(func, seen=None):
+    """Return a string identifying a function by its name, code and state.
+
+    The state of a function is its default arguments and the values of the
+    variables it closes over, the state of a bound method or callable object
+    is its public attributes.
+
+    Returns:
+        Optional[str]: The identity, or None if the function holds state
+        which can't be identified.
+    """
+    seen = set() if seen is None else seen
+    if id(func) in seen:
+        # A recursive reference, already being identified
+        return 'recursive'
+    seen = seen | {id(func)}
+
+    if isinstance(func, functools.partial):
+        parts = [_func_identity(func.func, seen),
+                 _value_identity(func.args, seen),
+                 _value_identity(func.keywords, seen)]
+    elif isinstance(func, types.MethodType):
+        parts = [_func_identity(func.__func__, seen),
+                 _value_identity(func.__self__, seen)]
+    elif isinstance(func, types.FunctionType):
+        code = func.__code__
+        cells = []
+        for cell in func.__closure__ or ():
+            try:
+                cells.append(cell.cell_contents)
+            except ValueError:
+                # The variable hasn't been assigned yet
+                cells.append(None)
+        parts = [_qualified_name(func),
+                 _code_fingerprint(code),
+                 _value_identity(func.__defaults__, seen),
+                 _value_identity(func.__kwdefaults__, seen),
+                 _value_identity(cells, seen)]
+    elif isinstance(func, (type, types.BuiltinFunctionType, np.ufunc)):
+        parts = [_qualified_name(func)]
+        owner = getattr(func, '__self__', None)
+        if owner is not None and not isinstance(owner, types.ModuleType):
+            # A builtin method bound to an object
+            parts.append(_value_identity(owner, seen))
+    elif hasattr(func, '__dict__'):
+        parts = [_qualified_name(type(func)), _attrs_identity(func, seen)]
+        if hasattr(func, '__name__'):
+            # A wrapped function, e.g. numpy's array function dispatchers
+            parts.insert(1, _qualified_name(func))
+    else:
+        return None
+
+    if None in parts:
+        return None
+    return ':'.join(parts)
+
+
+def _code_fingerprint(code):
+    """Return a hash of a code object which is the same in every process."""
+    digest = hashlib.blake2b(digest_size=8)
+    _update_code_digest(digest, code)
+    return digest.hexdigest()
+
+
+def _update_code_digest(digest, code):
+    """Add the bytecode, names and constants of a code object to a digest.
+
+    The names include the globals and attributes used, so calling a different
+    function changes the digest. Nested code objects (lambdas, functions and
+    comprehensions) are added recursively, as their repr includes their
+    address.
+    """
+    digest.update(code.co_code)
+    for names in (code.co_names, code.co_varnames, code.co_freevars,
+                  code.co_cellvars):
+        digest.update(b'\0' + ','.join(names).encode())
+    for const in code.co_consts:
+        digest.update(b'\0')
+        _update_const_digest(digest, const)
+
+
+def _update_const_digest(digest, const):
+    if isinstance(const, types.CodeType):
+        digest.update(b'code:')
+        _update_code_digest(digest, const)
+    elif isinstance(const, (tuple, frozenset)):
+        items = [_const_fingerprint(item) for item in const]
+        if isinstance(const, frozenset):
+            # Set order depends on the hash seed of the process
+            items.sort()
+        digest.update('{}({})'.format(type(const).__name__,
+                                      ','.join(items)).encode())
+    else:
+        digest.update(repr(const).encode())
+
+
+def _const_fingerprint(const):
+    digest = hashlib.blake2b(digest_size=8)
+    _update_const_digest(digest, const)
+    return digest.hexdigest()
+
+
+def _qualified_name(obj):
+    return '{}.{}'.format(getattr(obj, '__module__', None),
+                          getattr(obj, '__qualname__',
+                                  getattr(obj, '__name__', None)))
+
+
+def _attrs_identity(obj, seen):
+    """Identify an object by its public attributes.
+
+    Private attributes (starting with an underscore) are taken to be
+    internal state such as caches, which shouldn't change the results.
+    """
+    attrs = {name: value for name, value in vars(obj).items()
+             if not name.startswith('_')}
+    return _value_identity(attrs, seen)
+
+
+def _value_identity(value, seen):
+    """Return a string identifying a value, or None if it can't be."""
+    if value is None or isinstance(value, (bool, int, float, complex, str,
+                                           bytes, np.generic, np.dtype)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return 'array:' + hash_array(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        items = [_value_identity(item, seen) for item in value]
+        if None in items:
+            return None
+        if isinstance(value, (set, frozenset)):
+            items.sort()
+        return '{}({})'.format(type(value).__name__, ','.join(items))
+    if isinstance(value, dict):
+        items = [(_value_identity(key, seen), _value_identity(item, seen))
+                 for key, item in value.items()]
+        if any(None in pair for pair in items):
+            return None
+        return 'dict({})'.format(','.join(sorted(
+            '{}={}'.format(key, item) for key, item in items)))
+    if isinstance(value, types.ModuleType):
+        return 'module:' + value.__name__
+    if callable(value):
+        return _func_identity(value, seen)
+    if hasattr(value, '__dict__'):
+        if id(value) in seen:
+            return 'recursive'
+        attrs = _attrs_identity(value, seen | {id(value)})
+        if attrs is None:
+            return None
+        return '{}{}'.format(_qualified_name(type(value)), attrs)
+    return None
+
+
+_worker_pipeline = None
+
+
+def _set_worker_pipeline(pipeline):
+    """Store the Pipeline to run in a worker process."""
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+
+def _run_worker_pipeline(image):
+    """Run the worker process's Pipeline on an image."""
+    return _worker_pipeline.run(image)
+
+
+def _run_worker_shared(handle):
+    """Run the worker process's Pipeline on an image in shared memory.
+
+    If the result fits, it is written back to the same slot and the handle
+    is returned instead of the result.
+    """
+    image = attach(handle)
+    result = _worker_pipeline.run(image)
+    if isinstance(result, np.ndarray) and result.shape == image.shape \
+            and result.dtype == image.dtype:
+        if result is not image:
+            image[...] = result
+        return handle
+    return result
+
+
+class _PingPongBuffers:
+    """Pairs of reusable arrays for steps writing into an `out` argument.
+
+    A pair of buffers is kept for each shape and type, and a step is given
+    whichever of the pair doesn't hold its input, so consecutive steps
+    alternate between the two.
+    """
+
+    def __init__(self):
+        self.pairs = {}
+
+    def get(self, image):
+        """Return a buffer like `image` which does not overlap it."""
+        key = (image.shape, image.dtype.str)
+        pair = self.pairs.get(key)
+        if pair is None:
+            pair = self.pairs[key] = (np.empty_like(image),
+                                      np.empty_like(image))
+        if np.may_share_memory(pair[0], image):
+            return pair[1]
+        return pair[0]
+
+    def holds(self, array):
+        """Return True if `array` may use the memory of one of the buffers."""
+        return any(np.may_share_memory(buffer, array)
+                   for pair in self.pairs.values() for buffer in pair)
+
+
+class PipelineProfile:
+    """Timing and output statistics for each step of a Pipeline.
+
+    Created by `Pipeline.enable_profiling`, every call of a step records its
+    wall time and the shape, type and size of its output.
+
+    Args:
+        labels: The labels of the Pipeline steps.
+
+    Attributes:
+        durations: A dict mapping step index to a list of call durations in
+            seconds.
+        events: A list of (step index, start time, end time, thread id)
+            tuples, times are from `time.perf_counter`.
+
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.durations = defaultdict(list)
+        self.events = []
+        self.outputs = {}
+        self.output_bytes = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'PipelineProfile({} calls)'.format(len(self.events))
+
+    def record(self, index, start, end, output):
+        """Record a call of step `index`."""
+        # Steps on several threads can record at once
+        with self._lock:
+            self.durations[index].append(end - start)
+            self.events.append((index, start, end, threading.get_ident()))
+            if isinstance(output, np.ndarray):
+                self.outputs[index] = (output.shape, output.dtype)
+                self.output_bytes[index] += output.nbytes
+
+    def stats(self):
+        """Return a summary of each step, keyed by the step's label.
+
+        Returns:
+            dict: For each step, a dict of the number of calls, the total,
+            mean, p50, p95 and p99 times in seconds, the shape and dtype of
+            the last output, and the total bytes of the outputs.
+
+        """
+        stats = {}
+        for index, label in enumerate(self.labels):
+            with self._lock:
+                durations = np.array(self.durations.get(index, []))
+            shape, dtype = self.outputs.get(index, (None, None))
+            step_stats = {'calls': len(durations),
+                          'total': float(durations.sum()),
+                          'mean': None, 'p50': None, 'p95': None,
+                          'p99': None,
+                          'shape': shape,
+                          'dtype': None if dtype is None else str(dtype),
+                          'bytes': self.output_bytes.get(index, 0)}
+            if len(durations):
+                step_stats['mean'] = float(durations.mean())
+                (step_stats['p50'],
+                 step_stats['p95'],
+                 step_stats['p99']) = [float(value) for value in
+                                       np.percentile(durations, (50, 95, 99))]
+            if label in stats:
+                label = '{} ({})'.format(label, index + 1)
+            stats[label] = step_stats
+        return stats
+
+    def chrome_trace(self):
+        """Return the recorded calls in the Chrome trace event format.
+
+        The result can be saved with `save_trace` and viewed with
+        chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = [{'name': self.labels[index],
+                   'ph': 'X',
+                   'ts': (start - self.start) * 1e6,
+                   'dur': (end - start) * 1e6,
+                   'pid': pid,
+                   'tid': thread}
+                  for index, start, end, thread in self._events()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def _events(self):
+        with self._lock:
+            return list(self.events)
+
+    def save_trace(self, filename):
+        """Save the Chrome trace of the recorded calls to a json file."""
+        with open(filename, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+class _Stages:
+    """Threads running each step of a Pipeline as a separate stage.
+
+    Frames are numbered as they enter the first stage, and reordered when
+    they leave the last stage as stages with several workers can finish
+    frames out of order.
+
+    """
+
+    _END = object()
+
+    def __init__(self, pipeline, frames, queue_size):
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.queues = [queue.Queue(maxsize=queue_size)
+                       for _ in range(len(pipeline.steps) + 1)]
+        self.threads = [threading.Thread(target=self._feed, args=(frames,))]
+        for index, workers in enumerate(pipeline.workers):
+            # Count of workers still running, shared by the stage's workers
+            remaining = [workers]
+            self.threads.extend(
+                threading.Thread(target=self._work,
+                                 args=(pipeline, index, remaining))
+                for _ in range(workers))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _fail(self, error):
+        self.error = error
+        self.stopped.set()
+
+    def _feed(self, frames):
+        try:
+            for item in enumerate(frames):
+                if not core._put(self.queues[0], item, self.stopped):
+                    return
+        except Exception as error:
+            self._fail(error)
+            return
+        core._put(self.queues[0], self._END, self.stopped)
+
+    def _work(self, pipeline, index, remaining):
+        in_queue, out_queue = self.queues[index], self.queues[index + 1]
+        batch_size = pipeline.batch_sizes[index]
+        # An item taken from the queue which didn't fit in the last batch
+        carried = None
+        while not self.stopped.is_set():
+            if carried is not None:
+                item, carried = carried, None
+            else:
+                try:
+                    item = in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            if item is self._END:
+                # Leave the marker for the other workers of this stage, the
+                # last one to finish passes it on to the next stage
+                core._put(in_queue, item, self.stopped)
+                with self.lock:
+                    remaining[0] -= 1
+                    last = not remaining[0]
+                if last:
+                    core._put(out_queue, item, self.stopped)
+                return
+            try:
+                if batch_size:
+                    # Batches are stacked into an array, so compare frames
+                    # as arrays when gathering them
+                    items = [(item[0], np.asarray(item[1]))]
+                    carried = self._gather(in_queue, items, batch_size,
+                                           pipeline.max_latencies[index])
+                    images = pipeline._call_batch(
+                        index, [image for _, image in items])
+                else:
+                    items = [item]
+                    images = [pipeline._call_step(index, item[1])]
+            except Exception as error:
+                self._fail(error)
+                return
+            for (number, _), image in zip(items, images):
+                if not core._put(out_queue, (number, image), self.stopped):
+                    return
+
+    def _gather(self, in_queue, items, batch_size, max_latency):
+        """Add items arriving within `max_latency` to a batch.
+
+        Returns:
+            The item that ended the batch early, if it can't be batched with
+            the others, otherwise None.
+        """
+        deadline = time.monotonic() + max_latency
+        first = items[0][1]
+        while len(items) < batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = in_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is self._END:
+                return item
+            item = (item[0], np.asarray(item[1]))
+            if item[1].shape != first.shape or item[1].dtype != first.dtype:
+                return item
+            items.append(item)
+        return None
+
+    def __iter__(self):
+        waiting = {}
+        next_number = 0
+        out_queue = self.queues[-1]
+        while True:
+            try:
+                item = out_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+                continue
+            if item is self._END:
+                break
+            number, image = item
+            waiting[number] = image
+            while next_number in waiting:
+                yield waiting.pop(next_number)
+                next_number += 1
+
+    def close(self):
+        """Stop all the threads."""
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
@@ -1,11 +1,46 @@
-from contextlib import contextmanager
+import asyncio
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import bisect
+import glob
+import hashlib
+import json
+import pickle
+import queue
+import threading
+import time
+import zipfile
 
 import cv2
+import numpy as np
 import os
 import jowr
+from jowr.core import _put
 
+SKIP_THRESHOLD = 16
+"""Largest forward jump made by decoding frames rather than seeking."""
 
-class Capture:
+
+class _AsyncFrames:
+    """Mixin adding `aframes` to readers with an `open_frames` method."""
+
+    def aframes(self, read_ahead=2, **kwargs):
+        """Returns an async iterator over the frames.
+
+        Frames are read on a separate thread so the event loop is not blocked,
+        see the module level `jowr.aframes` for details.
+
+        Args:
+            read_ahead (int): Number of frames to request ahead of the
+                consumer.
+            **kwargs: Passed to `open_frames`.
+
+        """
+        return aframes(self, read_ahead, **kwargs)
+
+
+class Capture(_AsyncFrames):
     """Base class for readers that interact with OpenCVs VideoCapture object.
 
     Args:
@@ -19,12 +54,15 @@ class Capture:
             `open` context manager
         resolution (int, int): Native resolution of the source.
         frame_count (int): Total number of frames, 0 if a webcam
+        buffers (BufferRing): Buffers that frames are decoded into, None if
+            each frame is a new array.
 
     """
     def __init__(self, source):
         self.source = source
         self.next_frame_number = 0
         self.cap = None
+        self.buffers = None
 
         with self.open():
             width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -36,26 +74,72 @@ class Capture:
     def open(self):
         """Opens the `VideoCapture` object and releases when done."""
         self.cap = cv2.VideoCapture(self.source)
-        yield
-        self.cap.release()
+        try:
+            yield
+        finally:
+            self.cap.release()
+            self.cap = None
 
     @contextmanager
-    def open_frames(self):
-        """Returns a `Frames` object to iterate over the video."""
+    def open_frames(self, prefetch=0, buffers=0):
+        """Returns a `Frames` object to iterate over the video.
+
+        Args:
+            prefetch (int): If greater than 0, frames are decoded ahead of the
+                consumer on a background thread, holding at most `prefetch`
+                decoded frames in memory.
+            buffers (int): If greater than 0, frames are decoded into a
+                `BufferRing` of this many arrays which are reused, rather than
+                a new array for every frame.
+
+        Note:
+            When reusing buffers each frame is overwritten once `buffers`
+            more frames have been read, so a consumer may only hold on to the
+            most recent ``buffers - prefetch - 1`` frames (with prefetching, up
+            to ``prefetch + 1`` frames are held by the background thread). Copy
+            any frame that needs to be kept for longer.
+
+        Raises:
+            ValueError: If there are not enough buffers for the prefetching.
+
+        """
+        if buffers and prefetch and buffers <= prefetch + 1:
+            raise ValueError("At least prefetch + 2 buffers are needed when "
+                             "prefetching")
         with self.open():
-            yield Frames(self)
+            self.buffers = BufferRing(buffers) if buffers else None
+            frames = Frames(self, prefetch=prefetch)
+            try:
+                yield frames
+            finally:
+                frames.close()
+                self.buffers = None
 
-    def next_frame(self):
+    def next_frame(self, out=None):
         """Returns the next frame.
 
+        Args:
+            out (Optional[np.ndarray]): Array to decode the frame into, this
+                must be a contiguous uint8 array of shape (height, width, 3).
+
         Raises:
-            IndexError: I   f the end of the source has been reached.
+            IndexError: If the end of the source has been reached.
 
         """
         # TODO raise custom exception if not cap
-        exists, frame = self.cap.read()
+        use_ring = out is None and self.buffers is not None
+        if use_ring:
+            out = self.buffers.next()
+        exists, frame = self.cap.read(image=out)
         self.next_frame_number += 1
         if exists:
+            if use_ring:
+                # Keep whatever array OpenCV decoded into for next time
+                self.buffers.replace(frame)
+            elif out is not None and frame is not out:
+                # OpenCV allocated a new array, the buffer was not suitable
+                raise ValueError("Output buffer does not match the frame "
+                                 "size and type")
             return frame
         else:
             raise IndexError
@@ -69,31 +153,187 @@ class Video(Capture):
 
     Args:
         source (str): Path to video file.
+        seek_index (bool): Use a `SeekIndex` of the keyframes in the video to
+            speed up random access. The index is built on first use and
+            cached on disk.
+        cache_dir (Optional[str]): Directory to cache the seek index in, by
+            default it is saved next to the video file.
+        cache_bytes (int): Memory budget in bytes for a cache of decoded
+            frames, 0 to disable the cache.
+
+    Attributes:
+        seek_index (SeekIndex): Keyframe index, None if not used.
+        cache (jowr.LRUCache): Cache of decoded frames, None if not used.
 
     Raises:
         IOError: Specified video file was not found.
     """
 
-    def __init__(self, source):
+    def __init__(self, source, seek_index=False, cache_dir=None,
+                 cache_bytes=0):
         super().__init__(source)
         if not os.path.isfile(source):
             raise FileNotFoundError('File {}, not found'.format(source))
+        self.seek_index = None
+        if seek_index:
+            self.seek_index = SeekIndex.cached(source, cache_dir)
+        self.cache = jowr.LRUCache(cache_bytes) if cache_bytes else None
 
-    def get_frame(self, index):
+    def next_frame(self, out=None):
+        """Returns the next frame, adding it to the frame cache if used."""
+        index = self.next_frame_number
+        frame = super().next_frame(out)
+        if self.cache is not None:
+            # Cache a read-only copy, so changes to the returned frame (or a
+            # reused buffer) don't change the cached frame
+            cached = frame.copy()
+            cached.flags.writeable = False
+            self.cache.put(index, cached)
+        return frame
+
+    def get_frame(self, index, out=None):
         """Get a frame from the Video.
 
+        Small forward jumps are made by grabbing (without decoding) the frames
+        in between. If a `SeekIndex` is available, other jumps seek to the
+        nearest preceding keyframe and grab forward from there.
+
         Args:
             index (int): 0-based index to the frame to get.
+            out (Optional[np.ndarray]): Array to decode the frame into.
 
         Note:
             It is not recommended to call this method directly, frames from the
             webcam should be accessed using the `Frames` object returned by the
             `open_frames` method.
 
+        Note:
+            Frames served from the frame cache are shared between calls, so
+            are read-only. Copy them, or pass `out`, to modify them.
+
         """
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
-        self.next_frame_number = index
-        return self.next_frame()
+        if self.cache is not None:
+            frame = self.cache.get(index)
+            if frame is not None:
+                if out is None:
+                    return frame
+                out[...] = frame
+                return out
+
+        distance = index - self.next_frame_number
+        keyframe = None
+        if self.seek_index:
+            keyframe = self.seek_index.keyframe_before(index)
+
+        if distance >= 0 and (distance <= SKIP_THRESHOLD or
+                              (keyframe is not None and
+                               keyframe <= self.next_frame_number)):
+            self.skip(distance)
+        elif keyframe is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self.next_frame_number = keyframe
+            self.skip(index - keyframe)
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.next_frame_number = index
+        return self.next_frame(out)
+
+    def read_batch(self, start=0, stop=None, step=1, out=None):
+        """Read a range of frames into a single array.
+
+        Frames are decoded directly into one preallocated array of shape
+        (N, height, width, 3), avoiding an allocation per frame. The video is
+        opened for the duration of the call if it is not already open.
+
+        Args:
+            start (int): First frame to read.
+            stop (Optional[int]): Frame to stop before, by default the end of
+                the video.
+            step (int): Increment between frames.
+            out (Optional[np.ndarray]): uint8 array to read the frames into,
+                must have shape (N, height, width, 3) where N is the number of
+                frames in the range.
+
+        Returns:
+            np.ndarray: The frames, a view of `out` if given. If the video
+            ends early (the frame count reported by some containers is only an
+            estimate) only the frames read are returned.
+
+        """
+        indexes = range(*slice(start, stop, step).indices(len(self)))
+        width, height = self.resolution
+        shape = (len(indexes), height, width, 3)
+        if out is None:
+            out = np.empty(shape, np.uint8)
+        elif out.shape != shape or out.dtype != np.uint8:
+            raise ValueError("Output array should be uint8 with shape "
+                             "{}".format(shape))
+
+        if self.cap is None:
+            with self.open():
+                return self.read_batch(start, stop, step, out)
+
+        for batch_index, frame_index in enumerate(indexes):
+            try:
+                self.get_frame(frame_index, out=out[batch_index])
+            except IndexError:
+                return out[:batch_index]
+        return out
+
+    def parallel_map(self, func, start=0, stop=None, step=1, workers=None,
+                     shard_size=64):
+        """Apply a function to frames, decoding the video in parallel.
+
+        The frame range is split into shards of consecutive frames, and each
+        shard is decoded in a separate process which opens its own capture
+        and seeks to the start of the shard. Results are yielded in frame
+        order, and only a limited number of shards are in flight at once, so
+        memory use does not grow with the length of the video.
+
+        Args:
+            func: Function applied to each frame, the function and its results
+                must be picklable (e.g. a function defined at module level).
+            start (int): First frame.
+            stop (Optional[int]): Frame to stop before, by default the end of
+                the video.
+            step (int): Increment between frames.
+            workers (Optional[int]): Number of processes, defaults to the
+                number of CPUs.
+            shard_size (int): Number of frames decoded by a process per task.
+
+        Yields:
+            The result of `func` for each frame.
+
+        """
+        indexes = range(*slice(start, stop, step).indices(len(self)))
+        workers = workers or os.cpu_count()
+        executor = ProcessPoolExecutor(workers)
+        pending = deque()
+        try:
+            for shard_start in range(0, len(indexes), shard_size):
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+                shard = indexes[shard_start:shard_start + shard_size]
+                pending.append(executor.submit(_map_shard, self.source,
+                                               shard, func))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def skip(self, count):
+        """Advance the video by `count` frames without decoding them.
+
+        Raises:
+            IndexError: If the end of the video has been reached.
+
+        """
+        for _ in range(count):
+            if not self.cap.grab():
+                raise IndexError
+            self.next_frame_number += 1
 
     def __repr__(self):
         return 'Video({})'.format(self.source)
@@ -105,17 +345,76 @@ class Video(Capture):
 class Camera(Capture):
     """Class to read an attached webcam.
 
-        jowr's `Video` class wraps the existing `VideoCapture` class of OpenCV when
-        the specified source is a path to a video file.
+        jowr's `Camera` class wraps the existing `VideoCapture` class of OpenCV
+        when the specified source is the index of a webcam.
 
         Args:
-            source (str): Path to video file.
+            source (int): Index of the webcam.
+            low_latency (bool): Continuously read from the camera on a
+                background thread while it is open, so that `next_frame`
+                always returns the most recent frame. Frames that arrive while
+                the consumer is busy are dropped rather than buffered.
 
-        Raises:
-            IOError: Specified video file was not found.
+        Attributes:
+            dropped_frames (int): Number of frames dropped in low latency
+                mode.
+            frame_age (float): Time in seconds between the last frame
+                returned in low latency mode being read from the camera and
+                being returned.
         """
-    def __init__(self, source):
+    def __init__(self, source, low_latency=False):
+        self.grabber = None
+        # Only read the camera on a background thread once it's opened for
+        # frames, not while probing its properties
+        self.low_latency = False
         super().__init__(source)
+        self.low_latency = low_latency
+
+    @contextmanager
+    def open(self):
+        """Opens the `VideoCapture` object and releases when done.
+
+        In low latency mode this also runs the thread reading from the camera.
+        """
+        with super().open():
+            if self.low_latency:
+                self.grabber = _LatestFrameGrabber(self.cap)
+            try:
+                yield
+            finally:
+                if self.grabber is not None:
+                    self.grabber.stop()
+                    self.grabber = None
+
+    def next_frame(self, out=None):
+        """Returns the next frame.
+
+        In low latency mode this is the most recent frame read from the
+        camera, waiting for a new one if it has already been returned.
+
+        Args:
+            out (Optional[np.ndarray]): Array to decode the frame into.
+
+        Raises:
+            IndexError: If the end of the source has been reached.
+
+        """
+        if self.grabber is None:
+            return super().next_frame(out)
+        frame = self.grabber.latest()
+        self.next_frame_number += 1
+        if out is not None:
+            out[...] = frame
+            return out
+        return frame
+
+    @property
+    def dropped_frames(self):
+        return self.grabber.dropped if self.grabber else 0
+
+    @property
+    def frame_age(self):
+        return self.grabber.age if self.grabber else 0.0
 
     def get_frame(self, index):
         """Get a frame from the Webcam.
@@ -146,48 +445,854 @@ class Camera(Capture):
         return 'Camera({})'.format(self.source)
 
 
+class ImageSequence(_AsyncFrames):
+    """Class to read a sequence of image files.
+
+    Images are ordered using a natural sort of their filenames, so
+    'frame2.png' comes before 'frame10.png'. While the sequence is open,
+    upcoming images are decoded ahead of the consumer by a pool of threads
+    (OpenCV releases the GIL while decoding).
+
+    Args:
+        source: Path to a folder of images, a glob pattern, or a list of image
+            filenames.
+        workers (int): Number of threads used to decode images.
+        prefetch (int): Number of images to decode ahead of the one
+            requested, 0 to decode on the calling thread only.
+
+    Attributes:
+        source
+        filenames (List[str]): The images in the sequence, in order.
+        next_frame_number (int): 0-based index of the next frame to be called
+            using `next_frame`
+        resolution (int, int): Resolution of the first image, None if the
+            sequence is empty.
+        frame_count (int): Total number of images.
+
+    """
+
+    def __init__(self, source, workers=4, prefetch=8):
+        self.source = source
+        self.workers = workers
+        self.prefetch = prefetch
+        self.next_frame_number = 0
+        self._executor = None
+        self._pending = {}
+
+        if not isinstance(source, str):
+            filenames = list(source)
+        elif os.path.isdir(source):
+            filenames = jowr.find_images(source)
+        else:
+            filenames = glob.glob(source)
+        self.filenames = sorted(filenames, key=jowr.natural_sort_key)
+        self.frame_count = len(self.filenames)
+
+        self.resolution = None
+        if self.filenames:
+            self.resolution = jowr.resolution(self.read(0))
+
+    @contextmanager
+    def open(self):
+        """Starts the threads decoding images ahead, and stops them when done.
+        """
+        if self.workers and self.prefetch:
+            self._executor = ThreadPoolExecutor(self.workers)
+        try:
+            yield
+        finally:
+            if self._executor is not None:
+                for future in self._pending.values():
+                    future.cancel()
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._pending = {}
+
+    @contextmanager
+    def open_frames(self):
+        """Returns a `Frames` object to iterate over the sequence."""
+        with self.open():
+            yield Frames(self)
+
+    def read(self, index):
+        """Read and decode an image from the sequence.
+
+        Raises:
+            IOError: If the image could not be read.
+
+        """
+        image = cv2.imread(self.filenames[index])
+        if image is None:
+            raise IOError('Could not read image {}'.format(
+                self.filenames[index]))
+        return image
+
+    def next_frame(self):
+        """Returns the next frame.
+
+        Raises:
+            IndexError: If the end of the sequence has been reached.
+
+        """
+        return self.get_frame(self.next_frame_number)
+
+    def get_frame(self, index):
+        """Get a frame from the sequence.
+
+        Args:
+            index (int): 0-based index to the frame to get.
+
+        Raises:
+            IndexError: If the index is outside the sequence.
+
+        """
+        if not 0 <= index < self.frame_count:
+            raise IndexError
+        pending = self._pending.pop(index, None)
+        if pending is not None:
+            frame = pending.result()
+        else:
+            frame = self.read(index)
+        self.next_frame_number = index + 1
+        self._schedule(self.next_frame_number)
+        return frame
+
+    def _schedule(self, start):
+        """Decode the images following `start` on the thread pool."""
+        if self._executor is None:
+            return
+        wanted = range(start, min(start + self.prefetch, self.frame_count))
+        for index in list(self._pending):
+            if index not in wanted:
+                self._pending.pop(index).cancel()
+        for index in wanted:
+            if index not in self._pending:
+                self._pending[index] = self._executor.submit(self.read, index)
+
+    def __repr__(self):
+        return 'ImageSequence({})'.format(self.source)
+
+    def __len__(self):
+        return self.frame_count
+
+
+class ZipImages(ImageSequence):
+    """Class to read the images in a zip file.
+
+    Images are decoded straight from the compressed data in memory, nothing
+    is extracted to disk. Otherwise behaves like `ImageSequence`, including
+    natural sort ordering of the member names and decoding ahead on a thread
+    pool.
+
+    Args:
+        source (str): Path to the zip file.
+        workers (int): Number of threads used to decode images.
+        prefetch (int): Number of images to decode ahead of the one
+            requested, 0 to decode on the calling thread only.
+
+    Attributes:
+        zip_file (zipfile.ZipFile): The zip file while the reader is open,
+            otherwise None.
+
+    """
+
+    def __init__(self, source, workers=4, prefetch=8):
+        self.zip_file = None
+        self.zip_path = source
+        with zipfile.ZipFile(source) as zip_file:
+            members = [name for name in zip_file.namelist()
+                       if name.lower().endswith(jowr.IMAGE_EXTENSIONS)]
+        super().__init__(members, workers, prefetch)
+        self.source = source
+
+    @contextmanager
+    def open(self):
+        """Opens the zip file and starts the threads decoding images ahead,
+        closing both when done.
+        """
+        self.zip_file = zipfile.ZipFile(self.zip_path)
+        try:
+            with super().open():
+                yield
+        finally:
+            self.zip_file.close()
+            self.zip_file = None
+
+    def read(self, index):
+        """Read and decode an image from the zip file.
+
+        If the reader isn't open, the zip file is opened for this read only.
+
+        Raises:
+            IOError: If the image could not be decoded.
+
+        """
+        if self.zip_file is None:
+            with zipfile.ZipFile(self.zip_path) as zip_file:
+                data = zip_file.read(self.filenames[index])
+        else:
+            data = self.zip_file.read(self.filenames[index])
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise IOError('Could not decode image {} in {}'.format(
+                self.filenames[index], self.zip_path))
+        return image
+
+    def __repr__(self):
+        return 'ZipImages({})'.format(self.source)
+
+
+FrameSet = namedtuple('FrameSet', ['frames', 'timestamps'])
+"""Frames read together from several sources by `MultiCapture`, with the
+`time.monotonic` time at which each frame was grabbed."""
+
+
+class MultiCapture:
+    """Reads several `Capture` sources in step, e.g. a stereo camera rig.
+
+    Each source is read by its own thread. The threads wait for each other
+    and then `grab` a frame at the same moment, keeping the skew between the
+    sources as small as possible, before decoding the grabbed frames with
+    `retrieve` in parallel. Decoded frames are held on a bounded queue per
+    source, so throughput scales with the number of sources.
+
+    Args:
+        readers (List[Capture]): The sources to read, e.g. `Camera` or
+            `Video` objects.
+        queue_size (int): Number of frames per source that may be read ahead
+            of the consumer.
+
+    Examples:
+
+        >>> rig = jowr.MultiCapture([jowr.Camera(0), jowr.Camera(1)])
+        >>> with rig.open_frames() as frame_sets:
+        ...     for (left, right), timestamps in frame_sets:
+        ...         pass
+
+    """
+
+    def __init__(self, readers, queue_size=2):
+        if any(getattr(reader, 'low_latency', False) for reader in readers):
+            raise ValueError("MultiCapture can't read from a Camera in low "
+                             "latency mode")
+        self.readers = list(readers)
+        self.queue_size = queue_size
+
+    def __repr__(self):
+        return 'MultiCapture({})'.format(self.readers)
+
+    @contextmanager
+    def open_frames(self):
+        """Opens all the sources and returns an iterator of `FrameSet`."""
+        with ExitStack() as stack:
+            for reader in self.readers:
+                stack.enter_context(reader.open())
+            frame_sets = _SyncedFrames(self.readers, self.queue_size)
+            try:
+                yield frame_sets
+            finally:
+                frame_sets.close()
+
+
+class _SyncedFrames:
+    """Iterator of `FrameSet` from threads reading several sources."""
+
+    _END = object()
+
+    def __init__(self, readers, queue_size):
+        self.barrier = threading.Barrier(len(readers))
+        self.stopped = threading.Event()
+        self.ended = False
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in readers]
+        self.threads = [threading.Thread(target=self._run,
+                                         args=(reader, frame_queue),
+                                         daemon=True)
+                        for reader, frame_queue in zip(readers, self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, reader, frame_queue):
+        item = self._END
+        try:
+            while not self.stopped.is_set():
+                # Line up the sources, then grab all of them at once
+                self.barrier.wait()
+                grabbed = reader.cap.grab()
+                timestamp = time.monotonic()
+                if grabbed:
+                    grabbed, frame = reader.cap.retrieve()
+                if not grabbed:
+                    break
+                reader.next_frame_number += 1
+                if not _put(frame_queue, (frame, timestamp), self.stopped):
+                    return
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as error:
+            item = error
+        # Stop the other sources and let the consumer know we are done
+        self.barrier.abort()
+        _put(frame_queue, item, self.stopped)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.ended:
+            raise StopIteration
+        items = [frame_queue.get() for frame_queue in self.queues]
+        for item in items:
+            if item is self._END or isinstance(item, Exception):
+                self.ended = True
+                self.close()
+                if isinstance(item, Exception):
+                    raise item
+                raise StopIteration
+        frames, timestamps = zip(*items)
+        return FrameSet(frames, timestamps)
+
+    def close(self):
+        """Stop the threads and discard any frames not yet consumed."""
+        self.stopped.set()
+        self.barrier.abort()
+        for thread in self.threads:
+            thread.join()
+        for frame_queue in self.queues:
+            while not frame_queue.empty():
+                frame_queue.get_nowait()
+
+
+class FrameStore(_AsyncFrames):
+    """Reader for decoded frames stored in a memory-mapped file.
+
+    Decoding a video is often the most expensive part of processing it, so
+    when several passes are made over the same frames it is faster to decode
+    them once with `FrameStore.create` and read them back from the raw frame
+    store. Frames are served directly from the memory map, so random access
+    is O(1) and involves no copying or decoding.
+
+    The file holds a small header (shape, dtype and number of frames)
+    followed by the raw frame data.
+
+    Args:
+        source (str): Path to a frame store file.
+
+    Attributes:
+        source
+        next_frame_number (int): 0-based index of the next frame to be called
+            using `next_frame`
+        resolution (int, int): Resolution of the stored frames.
+        frame_count (int): Total number of frames.
+
+    Note:
+        Frames are read-only views of the file, copy a frame to modify it.
+
+    Examples:
+
+        Decode a video once, then make repeated passes over the frames:
+
+        >>> store = jowr.FrameStore.create('clip.frames',
+        ...                                jowr.Video('clip.mp4'))
+        >>> with store.open_frames() as frames:
+        ...     for frame in frames:
+        ...         pass
+
+    """
+
+    MAGIC = b'JOWRFRAMES'
+    HEADER_SIZE = 256
+
+    def __init__(self, source):
+        self.source = source
+        self.next_frame_number = 0
+
+        with open(source, 'rb') as store_file:
+            header = store_file.read(self.HEADER_SIZE)
+        if not header.startswith(self.MAGIC):
+            raise IOError('{} is not a jowr frame store'.format(source))
+        info = json.loads(header[len(self.MAGIC):].decode().strip())
+
+        self.frame_count = info['count']
+        shape = tuple(info['shape'])
+        self.resolution = (shape[1], shape[0])
+        self.data = np.memmap(source, dtype=np.dtype(info['dtype']), mode='r',
+                              offset=self.HEADER_SIZE,
+                              shape=(self.frame_count,) + shape)
+
+    @classmethod
+    def create(cls, filename, frames):
+        """Write frames to a new frame store.
+
+        Args:
+            filename (str): Path of the frame store file to create.
+            frames: A reader with an `open_frames` method (e.g. a `Video`),
+                or an iterable of frames such as a slice of a `Frames`
+                object. All frames must have the same shape and dtype.
+
+        Returns:
+            FrameStore: Reader for the new frame store.
+
+        Raises:
+            ValueError: If there are no frames, or they differ in shape or
+                type.
+
+        """
+        if hasattr(frames, 'open_frames'):
+            with frames.open_frames() as reader_frames:
+                return cls.create(filename, reader_frames)
+
+        count = 0
+        shape = dtype = None
+        with open(filename, 'wb') as store_file:
+            store_file.write(bytes(cls.HEADER_SIZE))
+            for frame in frames:
+                if shape is None:
+                    shape, dtype = frame.shape, frame.dtype
+                elif frame.shape != shape or frame.dtype != dtype:
+                    raise ValueError("Frames should all have the same shape "
+                                     "and type")
+                store_file.write(np.ascontiguousarray(frame).data)
+                count += 1
+
+            if not count:
+                raise ValueError("No frames to store")
+            info = json.dumps({'shape': shape,
+                               'dtype': dtype.str,
+                               'count': count}).encode()
+            store_file.seek(0)
+            store_file.write((cls.MAGIC + info).ljust(cls.HEADER_SIZE))
+        return cls(filename)
+
+    @contextmanager
+    def open(self):
+        """Provided for compatibility with `Capture`, the store is always open.
+        """
+        yield
+
+    @contextmanager
+    def open_frames(self):
+        """Returns a `Frames` object to iterate over the stored frames."""
+        yield Frames(self)
+
+    def next_frame(self):
+        """Returns the next frame.
+
+        Raises:
+            IndexError: If the end of the store has been reached.
+
+        """
+        return self.get_frame(self.next_frame_number)
+
+    def get_frame(self, index):
+        """Get a frame from the store.
+
+        Args:
+            index (int): 0-based index to the frame to get.
+
+        Raises:
+            IndexError: If the index is outside the store.
+
+        """
+        if not 0 <= index < self.frame_count:
+            raise IndexError
+        self.next_frame_number = index + 1
+        return self.data[index].view(np.ndarray)
+
+    def __repr__(self):
+        return 'FrameStore({})'.format(self.source)
+
+    def __len__(self):
+        return self.frame_count
+
+
 class Frames:
     """Iterable over frames from a non-memory source i.e. a reader.
 
     Args:
-        reader: `Video` or `Camera` object
+        reader: Reader with `get_frame` and `next_frame` methods, e.g. a
+            `Video`, `Camera`, `ImageSequence`, `ZipImages` or `FrameStore`.
         start (int): Start frame.
         stop (int): End frame.
         step (int): Increment between frames
+        prefetch (int): Number of frames to decode ahead on a background
+            thread, 0 to decode on the calling thread.
+
+    Note:
+        While prefetching, the background thread owns the reader. Indexing
+        the `Frames` object stops the prefetch thread before accessing the
+        reader, and iteration restarts it from the current position.
 
     """
 
-    def __init__(self, reader, start=0, stop=0, step=1):
+    def __init__(self, reader, start=0, stop=0, step=1, prefetch=0):
         self.reader = reader
         self.stop = stop
         self.step = step
         self.next_frame_number = start
+        self.prefetch = prefetch
+        self._prefetcher = None
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.next_frame_number >= self.stop > 0:
+        if self.prefetch > 0:
+            if self._prefetcher is None:
+                self._prefetcher = _Prefetcher(self, self.prefetch)
+            frame = self._prefetcher.get()
+            self.next_frame_number += self.step
+            return frame
+
+        frame = self._read(self.next_frame_number)
+        self.next_frame_number += self.step
+        return frame
+
+    def _read(self, index):
+        """Read the frame at `index`, raising StopIteration at the end."""
+        if index >= self.stop > 0:
             raise StopIteration
 
         try:
-            if self.next_frame_number != self.reader.next_frame_number:
-                frame = self.reader.get_frame(self.next_frame_number)
+            if index != self.reader.next_frame_number:
+                return self.reader.get_frame(index)
             else:
-                frame = self.reader.next_frame()
+                return self.reader.next_frame()
         except IndexError:
             raise StopIteration
-        self.next_frame_number += self.step
-        return frame
+
+    def close(self):
+        """Stop any background prefetching."""
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
 
     def __getitem__(self, item):
+        self.close()
         if isinstance(item, int):
             if item < self.reader.frame_count:
                 return self.reader.get_frame(item)
         elif isinstance(item, slice):
             return Frames(self.reader,
                           0 if item.start is None else item.start,
-                          item.stop,
-                          0 if item.step is None else item.step)
+                          0 if item.stop is None else item.stop,
+                          1 if item.step is None else item.step)
         else:
             raise TypeError
+
+
+async def aframes(reader, read_ahead=2, **kwargs):
+    """Asynchronously iterate over the frames of a reader.
+
+    The reader is opened with its `open_frames` method and frames are read on
+    a thread dedicated to this reader, so that reading does not block the
+    event loop and several readers can be consumed concurrently. Up to
+    `read_ahead` frames are requested ahead of the consumer.
+
+    Args:
+        reader: A reader with an `open_frames` method, e.g. a `Video`.
+        read_ahead (int): Number of frames to request ahead of the consumer.
+        **kwargs: Passed to `open_frames`.
+
+    Examples:
+
+        >>> async for frame in jowr.Video('clip.mp4').aframes():
+        ...     await process(frame)
+
+    Note:
+        If iteration is stopped early the reader is only closed when the
+        iterator is closed, close it with `aclose` to do so promptly.
+
+    """
+    loop = asyncio.get_running_loop()
+    # A single thread keeps reads from the reader in order
+    executor = ThreadPoolExecutor(1)
+    end = object()
+    context = reader.open_frames(**kwargs)
+    try:
+        frames = await loop.run_in_executor(executor, context.__enter__)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < max(read_ahead, 1):
+                    pending.append(loop.run_in_executor(executor, next,
+                                                        frames, end))
+                frame = await pending.popleft()
+                if frame is end:
+                    break
+                yield frame
+        finally:
+            for future in pending:
+                future.cancel()
+            await loop.run_in_executor(executor, context.__exit__,
+                                       None, None, None)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _map_shard(source, indexes, func):
+    """Apply `func` to a range of frames of a video, for `parallel_map`."""
+    video = Video(source)
+    with video.open():
+        return [func(video.get_frame(index)) for index in indexes]
+
+
+class BufferRing:
+    """A fixed size ring of reusable frame buffers.
+
+    Buffers are handed out in turn, so a buffer is reused after `size` calls
+    to `next`. Each slot is empty until the first frame has been decoded into
+    it, so the frame size does not need to be known in advance.
+
+    Args:
+        size (int): Number of buffers in the ring.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.buffers = [None] * size
+        self.position = -1
+
+    def __repr__(self):
+        return 'BufferRing({})'.format(self.size)
+
+    def next(self):
+        """Move to the next slot and return its buffer (None if empty)."""
+        self.position = (self.position + 1) % self.size
+        return self.buffers[self.position]
+
+    def replace(self, array):
+        """Set the buffer held in the current slot."""
+        self.buffers[self.position] = array
+
+
+class _LatestFrameGrabber:
+    """Continuously reads from a `VideoCapture`, keeping only the latest frame.
+
+    Attributes:
+        dropped (int): Number of frames replaced before being consumed.
+        age (float): Age in seconds of the last frame returned by `latest`.
+
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.frame = None
+        self.timestamp = None
+        self.dropped = 0
+        self.age = 0.0
+        self.ended = False
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped:
+            exists, frame = self.cap.read()
+            timestamp = time.monotonic()
+            with self.condition:
+                if exists:
+                    if self.frame is not None:
+                        self.dropped += 1
+                    self.frame = frame
+                    self.timestamp = timestamp
+                else:
+                    self.ended = True
+                self.condition.notify_all()
+            if not exists:
+                return
+
+    def latest(self):
+        """Return the most recent frame, waiting for one not yet returned.
+
+        Raises:
+            IndexError: If the source has ended.
+
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None or
+                                    self.ended or self.stopped)
+            if self.frame is None:
+                raise IndexError
+            frame, self.frame = self.frame, None
+            self.age = time.monotonic() - self.timestamp
+            return frame
+
+    def stop(self):
+        """Stop reading from the capture."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class SeekIndex:
+    """Positions of the keyframes in a video file.
+
+    Seeking in compressed video means decoding forward from a keyframe, so
+    knowing where the keyframes are lets `Video.get_frame` choose between
+    seeking and decoding forward from the current position. The index is
+    built by reading the packets of the video once (without decoding), and
+    is typically cached on disk using `SeekIndex.cached`.
+
+    Args:
+        keyframes (List[int]): Sorted 0-based frame numbers of the keyframes.
+        signature (Tuple): Size and modification time of the indexed file,
+            used to detect a stale cached index.
+
+    """
+
+    EXTENSION = '.jowridx'
+
+    def __init__(self, keyframes, signature=None):
+        self.keyframes = keyframes
+        self.signature = signature
+
+    def __repr__(self):
+        return 'SeekIndex({} keyframes)'.format(len(self.keyframes))
+
+    def __bool__(self):
+        return bool(self.keyframes)
+
+    def keyframe_before(self, index):
+        """Return the last keyframe at or before `index`, None if unknown."""
+        position = bisect.bisect_right(self.keyframes, index)
+        if position:
+            return self.keyframes[position - 1]
+        return None
+
+    @staticmethod
+    def file_signature(source):
+        """Return the (size, modification time) of a file."""
+        return os.path.getsize(source), os.path.getmtime(source)
+
+    @classmethod
+    def build(cls, source):
+        """Build the index by scanning the packets of a video file.
+
+        Keyframe detection requires the FFmpeg backend of OpenCV, for other
+        backends the returned index is empty and seeking falls back to
+        OpenCV's own behaviour.
+
+        Args:
+            source (str): Path to the video file.
+
+        """
+        keyframes = []
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+        try:
+            # Read raw packets, so nothing is decoded while scanning
+            if cap.isOpened() and cap.set(cv2.CAP_PROP_FORMAT, -1):
+                index = 0
+                while cap.grab():
+                    if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                        keyframes.append(index)
+                    index += 1
+        finally:
+            cap.release()
+        return cls(keyframes, cls.file_signature(source))
+
+    @classmethod
+    def index_path(cls, source, cache_dir=None):
+        """Return the path of the cached index for a video file."""
+        if cache_dir is None:
+            return source + cls.EXTENSION
+        # Include a hash of the full path, videos in different folders often
+        # share a file name
+        path_hash = hashlib.md5(
+            os.path.abspath(source).encode()).hexdigest()[:8]
+        return os.path.join(cache_dir, '{}-{}{}'.format(
+            os.path.basename(source), path_hash, cls.EXTENSION))
+
+    @classmethod
+    def cached(cls, source, cache_dir=None):
+        """Load the cached index for a video file, building it if needed.
+
+        Args:
+            source (str): Path to the video file.
+            cache_dir (Optional[str]): Directory to store the index in, by
+                default it is stored next to the video.
+
+        """
+        filename = cls.index_path(source, cache_dir)
+        if os.path.isfile(filename):
+            try:
+                index = cls.load(filename)
+                if index.signature == cls.file_signature(source):
+                    return index
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+
+        index = cls.build(source)
+        try:
+            index.save(filename)
+        except OSError:
+            # Not being able to cache the index is not fatal
+            pass
+        return index
+
+    def save(self, filename):
+        """Save the index to a file."""
+        with open(filename, 'wb') as index_file:
+            pickle.dump((self.keyframes, self.signature), index_file)
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index previously saved with `save`."""
+        with open(filename, 'rb') as index_file:
+            keyframes, signature = pickle.load(index_file)
+        return cls(keyframes, signature)
+
+
+class _Prefetcher:
+    """Decodes frames for a `Frames` object on a background thread.
+
+    Frames are put on a bounded queue so that at most `size` decoded frames
+    are held in memory. Errors raised by the reader are passed through the
+    queue and re-raised on the consuming thread.
+
+    """
+
+    _END = object()
+
+    def __init__(self, frames, size):
+        self.frames = frames
+        self.queue = queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        index = self.frames.next_frame_number
+        while not self.stopped.is_set():
+            try:
+                item = self.frames._read(index)
+            except StopIteration:
+                item = self._END
+            except Exception as error:
+                item = error
+            if not _put(self.queue, item, self.stopped) or \
+                    item is self._END or isinstance(item, Exception):
+                return
+            index += self.frames.step
+
+    def get(self):
+        """Return the next decoded frame."""
+        item = self.queue.get()
+        if item is self._END:
+            # Leave the marker for any further calls
+            self.queue.put(item)
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.queue.put(self._END)
+            raise item
+        return item
+
+    def stop(self):
+        """Stop the thread and discard any frames not yet consumed."""
+        self.stopped.set()
+        self.thread.join()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
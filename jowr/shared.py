@@ -0,0 +1,155 @@
+from collections import namedtuple
+from multiprocessing import shared_memory
+import queue
+import weakref
+
+import numpy as np
+
+SharedFrame = namedtuple('SharedFrame', ['name', 'shape', 'dtype', 'slot'])
+"""Reference to a frame held in a `SharedFramePool`, cheap to pickle."""
+
+
+class SharedFramePool:
+    """A pool of frame sized slots in shared memory.
+
+    Frames are passed to other processes by reference: a frame is copied
+    into a free slot of the pool, and the small `SharedFrame` handle is sent
+    instead of the pixel data. The receiving process uses `attach` to get
+    the frame as an array backed by the same memory, without copying.
+    Slots are returned to the pool with `release` once the frame is no longer
+    needed.
+
+    The process creating the pool owns the shared memory, and frees it when
+    the pool is closed, garbage collected, or the interpreter exits.
+
+    Args:
+        shape (Tuple[int]): Shape of each frame, e.g. (height, width, 3).
+        dtype: Numpy data type of the frames.
+        slots (int): Number of frames the pool can hold at once.
+
+    Examples:
+
+        Decode frames straight into shared memory:
+
+        >>> with jowr.SharedFramePool((480, 640, 3), slots=4) as pool:
+        ...     handle, frame = pool.acquire()
+        ...     video.next_frame(out=frame)
+        ...     # send handle to another process, which calls
+        ...     # jowr.attach(handle) to get the frame
+
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=max(self.frame_bytes * slots, 1))
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype,
+                                 buffer=self.memory.buf)
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._finalizer = weakref.finalize(self, _free_memory, self.memory)
+
+    def __repr__(self):
+        return 'SharedFramePool({}, {}, {} slots)'.format(self.shape,
+                                                          self.dtype,
+                                                          self.slots)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def acquire(self, timeout=None):
+        """Take a free slot from the pool, waiting for one if necessary.
+
+        Args:
+            timeout (Optional[float]): Maximum time in seconds to wait.
+
+        Returns:
+            (SharedFrame, np.ndarray): The handle of the slot, and the array
+            to write the frame into.
+
+        Raises:
+            queue.Empty: If no slot became free within the timeout.
+
+        """
+        slot = self._free.get(timeout=timeout)
+        handle = SharedFrame(self.memory.name, self.shape, self.dtype.str,
+                             slot)
+        return handle, self.frames[slot]
+
+    def put(self, frame, timeout=None):
+        """Copy a frame into a free slot and return its handle."""
+        handle, slot_frame = self.acquire(timeout)
+        slot_frame[...] = frame
+        return handle
+
+    def view(self, handle):
+        """Return the array held in the slot of a handle from this pool."""
+        return self.frames[handle.slot]
+
+    def release(self, handle):
+        """Return a slot to the pool, its contents may then be overwritten."""
+        self._free.put(handle.slot)
+
+    def fits(self, frame):
+        """Return True if a frame has the shape and type of the pool's slots.
+        """
+        return frame.shape == self.shape and frame.dtype == self.dtype
+
+    def close(self):
+        """Free the shared memory, no handles from the pool may be used after.
+        """
+        self.frames = None
+        self._finalizer()
+
+
+def _free_memory(memory):
+    """Close and remove a block of shared memory."""
+    try:
+        memory.close()
+    except BufferError:
+        # Arrays still refer to the memory, it is unmapped once they are gone
+        pass
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        pass
+
+
+_attached = {}
+
+
+def attach(handle):
+    """Return the frame referred to by a `SharedFrame` handle.
+
+    The returned array uses the shared memory of the pool directly. Shared
+    memory blocks stay attached for the life of the process, so repeated
+    calls for the same pool are cheap.
+
+    Args:
+        handle (SharedFrame): Handle from `SharedFramePool.acquire` or
+            `SharedFramePool.put`.
+
+    """
+    memory = _attached.get(handle.name)
+    if memory is None:
+        try:
+            # Only the creating process should remove the memory
+            memory = shared_memory.SharedMemory(name=handle.name, track=False)
+        except TypeError:
+            # track was added in Python 3.13
+            memory = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.name] = memory
+    dtype = np.dtype(handle.dtype)
+    offset = handle.slot * int(np.prod(handle.shape)) * dtype.itemsize
+    return np.ndarray(handle.shape, dtype, buffer=memory.buf, offset=offset)
@@ -0,0 +1,239 @@
+import datetime
+import os
+import queue
+import threading
+import zipfile
+
+import cv2
+
+import jowr
+
+
+class Sink:
+    """Base class for writing frames on a background thread.
+
+    Frames passed to `write` are put on a bounded queue and encoded by a
+    writer thread, so the code producing the frames only waits when the queue
+    is full. The thread is started by the first `write` and stopped by
+    `close`, which waits for all the queued frames to be written. Sinks can be
+    used as context managers to close them automatically.
+
+    Subclasses implement `write_frame`, and `finish` to release any resources.
+
+    Args:
+        queue_size (int): Maximum number of frames waiting to be written.
+
+    Attributes:
+        frames_written (int): Number of frames written so far.
+
+    Note:
+        Frames are written after `write` returns, so they must not be
+        modified afterwards (e.g. frames from a reader reusing buffers should
+        be copied).
+
+    """
+
+    _END = object()
+
+    def __init__(self, queue_size=8):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.error = None
+        self.frames_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, frame):
+        """Queue a frame to be written.
+
+        Raises:
+            Exception: Any error raised while writing an earlier frame.
+
+        """
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put(frame)
+
+    def close(self):
+        """Write any queued frames and release the sink.
+
+        Raises:
+            Exception: Any error raised while writing frames.
+
+        """
+        if self.thread is not None:
+            self.queue.put(self._END)
+            self.thread.join()
+            self.thread = None
+        self.finish()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is self._END:
+                return
+            if self.error is not None:
+                # Keep emptying the queue so writers don't block
+                continue
+            try:
+                self.write_frame(frame)
+                self.frames_written += 1
+            except Exception as error:
+                self.error = error
+
+    def write_frame(self, frame):
+        """Write a single frame, called on the writer thread."""
+        raise NotImplementedError
+
+    def finish(self):
+        """Release resources once all frames are written."""
+        pass
+
+
+class VideoSink(Sink):
+    """Writes frames to a video file.
+
+    The video is created when the first frame arrives, using its size.
+
+    Args:
+        filename (str): Path of the video file to write.
+        fps (float): Frame rate of the video.
+        fourcc (str): Four character code of the codec, e.g. 'MJPG' or
+            'mp4v'.
+        queue_size (int): Maximum number of frames waiting to be written.
+
+    """
+
+    def __init__(self, filename, fps=30.0, fourcc='MJPG', queue_size=8):
+        super().__init__(queue_size)
+        self.filename = filename
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def __repr__(self):
+        return 'VideoSink({})'.format(self.filename)
+
+    def write_frame(self, frame):
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(self.filename,
+                                          cv2.VideoWriter_fourcc(*self.fourcc),
+                                          self.fps,
+                                          jowr.resolution(frame),
+                                          jowr.channels(frame) == 3)
+            if not self.writer.isOpened():
+                raise IOError('Could not open {} for writing'.format(
+                    self.filename))
+        self.writer.write(frame)
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+
+class ImageSequenceSink(Sink):
+    """Writes frames to numbered image files in a folder.
+
+    Args:
+        folder (str): Folder to write the images to, created if needed.
+        pattern (str): Format string for the file names, formatted with the
+            frame number. The extension sets the image type.
+        queue_size (int): Maximum number of frames waiting to be written.
+
+    """
+
+    def __init__(self, folder, pattern='frame{:06d}.png', queue_size=8):
+        super().__init__(queue_size)
+        self.folder = folder
+        self.pattern = pattern
+        os.makedirs(folder, exist_ok=True)
+
+    def __repr__(self):
+        return 'ImageSequenceSink({})'.format(self.folder)
+
+    def write_frame(self, frame):
+        filename = os.path.join(self.folder,
+                                self.pattern.format(self.frames_written))
+        if not cv2.imwrite(filename, frame):
+            raise IOError('Could not write image {}'.format(filename))
+
+
+class ZipSink(Sink):
+    """Writes frames as images in a zip file.
+
+    Images are encoded in memory on the writer thread and added to the zip
+    file, which stays open until the sink is closed, so the code producing
+    frames never waits on encoding or disk access.
+
+    Image names are made from `pattern`, formatted with the frame number (as
+    the first positional argument) and `time`, the `datetime` at which the
+    frame was passed to `write`. The default names frames by their capture
+    time to the microsecond. If a name is already in the zip file a counter is
+    added to it, so names never collide.
+
+    Args:
+        filename (str): Path of the zip file.
+        pattern (str): Format string for the names of the images in the zip.
+            The extension sets the image type.
+        mode (str): 'a' to add to the zip file (creating it if it doesn't
+            exist), 'w' to replace it.
+        compression (int): Zip compression method, e.g. `zipfile.ZIP_STORED`
+            or `zipfile.ZIP_DEFLATED`. Compressed image formats such as png
+            gain little from compressing again, so they are stored by
+            default.
+        compresslevel (Optional[int]): Compression level, see
+            `zipfile.ZipFile`.
+        queue_size (int): Maximum number of frames waiting to be written.
+
+    Examples:
+
+        >>> with jowr.ZipSink('captures.zip') as archive:
+        ...     for frame in frames:
+        ...         archive.write(frame)
+
+    """
+
+    def __init__(self, filename, pattern='{time:%Y%m%d-%H%M%S-%f}.png',
+                 mode='a', compression=zipfile.ZIP_STORED, compresslevel=None,
+                 queue_size=8):
+        super().__init__(queue_size)
+        self.filename = filename
+        self.pattern = pattern
+        self.extension = os.path.splitext(pattern)[1]
+        self.zip_file = zipfile.ZipFile(filename, mode, compression,
+                                        compresslevel=compresslevel)
+        self.names = set(self.zip_file.namelist())
+        # Continue numbering after any images already in the file
+        self.first_number = len(self.names)
+
+    def __repr__(self):
+        return 'ZipSink({})'.format(self.filename)
+
+    def write(self, frame):
+        # Record when the frame arrived, not when it is written
+        super().write((frame, datetime.datetime.now()))
+
+    def write_frame(self, item):
+        frame, timestamp = item
+        success, encoded = cv2.imencode(self.extension, frame)
+        if not success:
+            raise IOError('Could not encode image as {}'.format(
+                self.extension))
+        name = self.pattern.format(self.first_number + self.frames_written,
+                                   time=timestamp)
+        self.zip_file.writestr(jowr.unique_name(name, self.names),
+                               encoded.tobytes())
+
+    def finish(self):
+        self.zip_file.close()
+
@@ -6,6 +6,7 @@ setup(
     name='jowr',
     version='0.0',
     packages=find_packages(),
+    python_requires='>=3.8',
     license='TBD',
     description='TBD',
     author='Justin Pinkney',
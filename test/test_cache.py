@@ -0,0 +1,31 @@
+import sys, os
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+import jowr
+import numpy as np
+
+
+def test_lru_cache():
+    cache = jowr.LRUCache(max_bytes=200)
+    cache.put('a', np.zeros(100, np.uint8))
+    cache.put('b', np.zeros(100, np.uint8))
+    assert cache.get('a') is not None
+    cache.put('c', np.zeros(100, np.uint8))
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Too large to ever fit
+    cache.put('d', np.zeros(300, np.uint8))
+    assert 'd' not in cache
+
+
+def test_hash_array():
+    array = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    assert jowr.hash_array(array) == jowr.hash_array(array.copy())
+    assert jowr.hash_array(array) != jowr.hash_array(array.reshape(4, 3))
+    assert jowr.hash_array(array) != jowr.hash_array(array.astype(np.int64))
+    # Non contiguous arrays are hashed by their contents
+    assert jowr.hash_array(array.T) == jowr.hash_array(array.T.copy())
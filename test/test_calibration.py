@@ -5,6 +5,7 @@ from zipfile import ZipFile
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../')
 
+import cv2
 import jowr
 import numpy as np
 import pytest
@@ -82,3 +83,119 @@ def test_no_images():
     calibrator = jowr.Calibrator()
     with pytest.raises(ValueError):
         calibrator.calibrate(no_image_folder)
+
+
+def test_parallel_detection():
+    zip_filename = 'data/example_cal/test.zip'
+
+    serial = jowr.Calibrator()
+    serial.showFrames = False
+    expected_cal = serial.calibrate(zip_filename)
+
+    calibrator = jowr.Calibrator()
+    calibrator.showFrames = False
+    calibration = calibrator.calibrate(zip_filename, workers=4)
+    assert len(calibrator.img_points) == len(serial.img_points)
+    assert np.allclose(calibration['matrix'], expected_cal['matrix'])
+    assert np.allclose(calibration['distortion'],
+                       expected_cal['distortion'])
+
+
+def test_coarse_to_fine_detection():
+    zip_filename = 'data/example_cal/test.zip'
+    images = jowr.ZipImages(zip_filename)
+    image = images.get_frame(0)
+
+    # Compare with corners found and refined at full resolution
+    full_corners = jowr.Calibrator().detect(image)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    full_corners = cv2.cornerSubPix(gray, full_corners, (4, 4), (-1, -1),
+                                    criteria)
+    coarse_corners = jowr.Calibrator(pyramid_levels=1).detect(image)
+    assert coarse_corners.shape == full_corners.shape
+    assert np.abs(coarse_corners - full_corners).max() < 0.5
+
+    calibrator = jowr.Calibrator(pyramid_levels=1)
+    calibrator.showFrames = False
+    calibration = calibrator.calibrate(zip_filename)
+    assert len(calibrator.img_points) == 7
+    # Refining the corners reduces the reprojection error
+    assert calibration['error'] < 0.5
+
+
+def test_detection_cache(tmpdir, monkeypatch):
+    zip_filename = str(tmpdir.join('test.zip'))
+    shutil.copy('data/example_cal/test.zip', zip_filename)
+
+    calibrator = jowr.Calibrator(detection_cache=True)
+    calibrator.showFrames = False
+    expected_cal = calibrator.calibrate(zip_filename)
+    assert os.path.isfile(jowr.Calibrator.detections_path(zip_filename))
+    # Detections aren't kept for later calibrations from other sources
+    assert calibrator.detections is None
+
+    # Detection is skipped when calibrating from the same images again
+    def fail(*args):
+        raise AssertionError("Detection should have been cached")
+    monkeypatch.setattr(jowr.calibration, 'find_chequerboard', fail)
+
+    calibrator = jowr.Calibrator(detection_cache=True)
+    calibrator.showFrames = False
+    calibration = calibrator.calibrate(zip_filename, workers=2)
+    assert np.allclose(calibration['matrix'], expected_cal['matrix'])
+
+    # Different detection settings are cached separately
+    calibrator = jowr.Calibrator(detection_cache=True, pyramid_levels=1)
+    with pytest.raises(AssertionError):
+        calibrator.calibrate(zip_filename)
+
+    # Caches holding pickled objects aren't loaded
+    np.savez(jowr.Calibrator.detections_path(zip_filename),
+             corners=np.array([None], dtype=object))
+    calibrator = jowr.Calibrator(detection_cache=True)
+    calibrator.load_detections(zip_filename)
+    assert calibrator.detections == {}
+
+
+def test_undistorter():
+    with open('data/example_cal/test_cal.p', 'rb') as f:
+        calibration = pickle.load(f)
+    images = jowr.ZipImages('data/example_cal/test.zip')
+    frames = np.stack([images.get_frame(0), images.get_frame(1)])
+    expected = jowr.undistort(frames[0], calibration)
+
+    undistorter = jowr.Undistorter(calibration, fixed_point=False)
+    result = undistorter(frames[0])
+    assert np.abs(result.astype(int) - expected).mean() < 0.5
+    # Maps are only computed once per resolution
+    assert undistorter.maps(calibration['resolution']) is \
+        undistorter.maps(calibration['resolution'])
+
+    undistorter = jowr.Undistorter(calibration)
+    result = undistorter(frames[0])
+    assert np.abs(result.astype(int) - expected).mean() < 1
+
+    batch = undistorter(frames)
+    assert np.array_equal(batch[0], result)
+
+    # Frames at a lower resolution are undistorted with a scaled matrix
+    half = jowr.scale(frames[0], 0.5)
+    assert np.abs(undistorter(half).astype(int) -
+                  jowr.scale(expected, 0.5)).mean() < 5
+
+    # Grayscale batches, e.g. from a batch step of a Pipeline
+    gray = np.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                     for frame in frames])
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(undistorter.undistort_batch, 'undistort', batch_size=2)
+    results = list(pipeline.stream(gray))
+    assert len(results) == 2
+    assert np.array_equal(results[0], undistorter(gray[0]))
+    assert np.array_equal(undistorter.undistort_batch(gray)[1],
+                          undistorter(gray[1]))
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(undistorter, 'undistort', accepts_out=True)
+    pipeline.reuse_buffers = True
+    assert np.array_equal(pipeline.run(frames[0]), result)
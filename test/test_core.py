@@ -3,6 +3,9 @@ import sys, os
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../')
 
+from zipfile import ZipFile
+
+import cv2
 import jowr
 import numpy as np
 
@@ -32,3 +35,30 @@ def test_find_images():
     found_images = [os.path.split(this_file)[1] for this_file in jowr.find_images(folder)]
 
     assert set(found_images) == set(files)
+
+
+def test_natural_sort_key():
+    names = ['frame10.png', 'frame2.png', 'Frame1.png']
+    assert sorted(names, key=jowr.natural_sort_key) == \
+        ['Frame1.png', 'frame2.png', 'frame10.png']
+
+
+def test_add_to_zip(tmpdir):
+    zip_name = str(tmpdir.join('images.zip'))
+    image = np.zeros((10, 20, 3), np.uint8)
+    # Images added within the same second don't overwrite each other
+    for _ in range(3):
+        jowr.add_to_zip(image, zip_name)
+
+    with ZipFile(zip_name) as zip_file:
+        names = zip_file.namelist()
+        assert len(set(names)) == 3
+        data = np.frombuffer(zip_file.read(names[0]), np.uint8)
+    assert cv2.imdecode(data, cv2.IMREAD_COLOR).shape == image.shape
+
+
+def test_unique_name():
+    names = {'a.png', 'a-1.png'}
+    assert jowr.unique_name('a.png', names) == 'a-2.png'
+    assert jowr.unique_name('b.png', names) == 'b.png'
+    assert names == {'a.png', 'a-1.png', 'a-2.png', 'b.png'}
@@ -0,0 +1,359 @@
+import sys, os
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+from functools import partial
+import json
+import pickle
+import random
+import subprocess
+import time
+
+import jowr
+import numpy as np
+import pytest
+
+
+def make_pipeline():
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(np.fliplr, 'flip')
+    pipeline.add_step(partial(np.add, 1), 'add one')
+    return pipeline
+
+
+def make_frames(count=20):
+    return [np.full((4, 6), index, np.int64) for index in range(count)]
+
+
+def test_run():
+    pipeline = make_pipeline()
+    image = np.arange(6).reshape(2, 3)
+    assert np.array_equal(pipeline.run(image), np.fliplr(image) + 1)
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_map(backend):
+    pipeline = make_pipeline()
+    results = pipeline.map(make_frames(), workers=2, backend=backend,
+                           max_in_flight=3)
+    assert [result[0, 0] for result in results] == list(range(1, 21))
+
+
+def test_map_bad_backend():
+    with pytest.raises(ValueError):
+        next(make_pipeline().map(make_frames(), backend='gpu'))
+
+
+def test_stream():
+    def slow_add_one(image):
+        time.sleep(random.random() * 0.01)
+        return image + 1
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(np.fliplr, 'flip')
+    pipeline.add_step(slow_add_one, 'slow add one', workers=3)
+    pipeline.add_step(partial(np.multiply, 2), 'double')
+
+    results = pipeline.stream(make_frames(), queue_size=2)
+    assert [result[0, 0] for result in results] == \
+        [2 * (index + 1) for index in range(20)]
+
+    # Stopping early shuts down the stages
+    results = pipeline.stream(make_frames())
+    assert next(results)[0, 0] == 2
+    results.close()
+
+
+def test_stream_error():
+    def fail(image):
+        raise RuntimeError("step failed")
+
+    pipeline = make_pipeline()
+    pipeline.add_step(fail)
+    with pytest.raises(RuntimeError):
+        list(pipeline.stream(make_frames()))
+
+
+def test_stream_batch_error():
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(lambda batch: batch + 1, batch_size=4)
+    # Frames which aren't arrays are batched as arrays
+    frames = [[[index]] for index in range(10)]
+    assert [frame[0, 0] for frame in pipeline.stream(frames)] == \
+        list(range(1, 11))
+
+    # Errors gathering a batch stop the stream
+    frames = [np.zeros((2, 2))] * 3 + [[[1, 2], [3]]]
+    with pytest.raises(ValueError):
+        list(pipeline.stream(frames))
+
+
+def test_profiling(tmpdir):
+    pipeline = make_pipeline()
+    assert pipeline.profile is None
+
+    profile = pipeline.enable_profiling()
+    for frame in make_frames(10):
+        pipeline.run(frame)
+    list(pipeline.stream(make_frames(5)))
+
+    stats = profile.stats()
+    assert list(stats) == pipeline.labels
+    assert stats['flip']['calls'] == 15
+    assert stats['add one']['shape'] == (4, 6)
+    assert stats['add one']['dtype'] == 'int64'
+    assert stats['add one']['bytes'] == 15 * 4 * 6 * 8
+    assert stats['flip']['p50'] <= stats['flip']['p99']
+
+    trace_file = str(tmpdir.join('trace.json'))
+    profile.save_trace(trace_file)
+    with open(trace_file) as f:
+        trace = json.load(f)
+    assert len(trace['traceEvents']) == 30
+
+    assert pipeline.disable_profiling() is profile
+    pipeline.run(make_frames(1)[0])
+    assert profile.stats()['flip']['calls'] == 15
+
+
+def test_profiling_threads():
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(np.fliplr, 'flip', workers=4)
+    profile = pipeline.enable_profiling()
+    frames = make_frames(200)
+    list(pipeline.stream(frames))
+    assert profile.stats()['flip']['calls'] == 200
+    assert profile.stats()['flip']['bytes'] == sum(frame.nbytes
+                                                   for frame in frames)
+    # Profiled Pipelines can still be sent to worker processes
+    assert len(list(pipeline.map(frames, workers=2,
+                                 backend='process'))) == 200
+
+
+def test_map_shared_memory():
+    pipeline = make_pipeline()
+    frames = make_frames()
+    # A frame of a different shape is pickled instead
+    frames[5] = np.full((2, 2), 5, np.int64)
+    results = list(pipeline.map(frames, workers=2, backend='process',
+                                shared_memory=True))
+    assert [result[0, 0] for result in results] == list(range(1, 21))
+    assert results[5].shape == (2, 2)
+
+
+def test_batch_step(monkeypatch):
+    batch_shapes = []
+
+    def batch_add_one(images):
+        assert images.ndim == 3
+        batch_shapes.append(images.shape)
+        return images + 1
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(np.fliplr, 'flip')
+    pipeline.add_step(batch_add_one, 'add one', batch_size=4, max_latency=1)
+    pipeline.add_step(partial(np.multiply, 2), 'double')
+
+    # Single images are run as a batch of one
+    assert pipeline.run(make_frames(1)[0])[0, 0] == 2
+    assert batch_shapes.pop() == (1, 4, 6)
+
+    # As is each step shown by run_and_show
+    shown = []
+    monkeypatch.setattr(jowr.core, 'show',
+                        lambda image, window_name: shown.append(image))
+    pipeline.run_and_show(make_frames(1)[0])
+    assert [image.shape for image in shown] == [(4, 6)] * 3
+    assert shown[-1][0, 0] == 2
+    assert batch_shapes.pop() == (1, 4, 6)
+
+    frames = make_frames(10)
+    # A frame of a different shape ends a batch early
+    frames[6] = np.full((2, 2), 6, np.int64)
+    results = list(pipeline.stream(frames))
+    assert [result[0, 0] for result in results] == \
+        [2 * (index + 1) for index in range(10)]
+    assert sum(shape[0] for shape in batch_shapes) == 10
+    assert all(shape[0] <= 4 for shape in batch_shapes)
+    assert (1, 2, 2) in batch_shapes
+
+
+# Calls of counted steps, global so it isn't part of the steps' state
+calls = []
+
+
+def counted(func):
+    def step(image):
+        calls.append(func.__name__)
+        return func(image)
+    return step
+
+
+def test_cache(tmpdir):
+    del calls[:]
+
+    def flip(image):
+        return np.fliplr(image)
+
+    def add_one(image):
+        return image + 1
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(counted(flip), 'flip')
+    pipeline.add_step(counted(add_one), 'add one', version=1)
+    cache = pipeline.enable_cache(directory=str(tmpdir))
+    image = np.arange(6).reshape(2, 3)
+    expected = np.fliplr(image) + 1
+
+    assert np.array_equal(pipeline.run(image), expected)
+    assert calls == ['flip', 'add_one']
+    # Changing the result doesn't affect the cache
+    pipeline.run(image)[...] = 0
+    assert np.array_equal(pipeline.run(image), expected)
+    assert calls == ['flip', 'add_one']
+
+    # Only the steps after the changed one are rerun
+    pipeline.versions[1] = 2
+    assert np.array_equal(pipeline.run(image), expected)
+    assert calls == ['flip', 'add_one', 'add_one']
+
+    # Results are also found on disk
+    cache.clear()
+    assert np.array_equal(pipeline.run(image), expected)
+    assert len(calls) == 3
+
+    # A different image misses the cache
+    pipeline.run(image + 1)
+    assert len(calls) == 5
+
+
+def test_cache_step_code():
+    def step(image):
+        return np.fliplr(image)
+
+    def changed_step(image):
+        return np.flipud(image)
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(step, 'step')
+    pipeline.enable_cache()
+    image = np.arange(6).reshape(2, 3)
+    assert np.array_equal(pipeline.run(image), np.fliplr(image))
+
+    # Editing the step to call a different function reruns it
+    changed_step.__qualname__ = step.__qualname__
+    pipeline.steps[0] = changed_step
+    assert np.array_equal(pipeline.run(image), np.flipud(image))
+
+
+def test_cache_key_stable_across_processes():
+    script = """
+import sys
+sys.path.insert(0, {root!r})
+import numpy as np
+from jowr.pipeline import _func_identity
+
+def step(image):
+    values = [value + 1 for value in image]
+    scale = lambda value: value * 2
+    return np.stack([scale(value) for value in values if value not in {{1, 'a'}}])
+
+print(_func_identity(step))
+""".format(root=os.path.join(myPath, '..'))
+    identities = set()
+    for seed in ('1', '2'):
+        environment = dict(os.environ, PYTHONHASHSEED=seed)
+        identities.add(subprocess.check_output([sys.executable, '-c', script],
+                                               env=environment))
+    assert len(identities) == 1
+
+
+def test_cache_step_state():
+    del calls[:]
+
+    def make_add(amount):
+        def add(image):
+            return image + amount
+        return counted(add)
+
+    class Scale:
+        def __init__(self, factor):
+            self.factor = factor
+            self._calls = 0
+
+        def __call__(self, image):
+            self._calls += 1
+            return image * self.factor
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(make_add(1), 'add')
+    pipeline.add_step(Scale(2), 'scale')
+    pipeline.enable_cache()
+    image = np.arange(6).reshape(2, 3)
+
+    assert np.array_equal(pipeline.run(image), (image + 1) * 2)
+    assert np.array_equal(pipeline.run(image), (image + 1) * 2)
+    assert calls == ['add']
+    assert pipeline.steps[1]._calls == 1
+
+    # Rebinding a closure variable or changing an attribute reruns the step
+    pipeline.steps[0] = make_add(5)
+    assert np.array_equal(pipeline.run(image), (image + 5) * 2)
+    assert calls == ['add', 'add']
+    pipeline.steps[1].factor = 3
+    assert np.array_equal(pipeline.run(image), (image + 5) * 3)
+    assert pipeline.steps[1]._calls == 3
+
+    # Steps with state which can't be identified are only cached with a
+    # version
+    counter = iter(range(10))
+    pipeline.steps[1] = lambda image, counter=counter: image + next(counter)
+    assert not np.array_equal(pipeline.run(image), pipeline.run(image))
+    pipeline.versions[1] = 1
+    assert np.array_equal(pipeline.run(image), pipeline.run(image))
+
+
+def test_reuse_buffers():
+    outs = []
+
+    def add_one(image, out=None):
+        outs.append(out)
+        return np.add(image, 1, out=out)
+
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(add_one, 'add one', accepts_out=True)
+    pipeline.add_step(np.fliplr, 'flip')
+    pipeline.add_step(add_one, 'add one again', accepts_out=True)
+    image = np.arange(6).reshape(2, 3)
+    expected = np.fliplr(image + 1) + 1
+
+    # Without reusing buffers steps aren't given out
+    assert np.array_equal(pipeline.run(image), expected)
+    assert outs == [None, None]
+
+    pipeline.reuse_buffers = True
+    first = pipeline.run(image)
+    assert np.array_equal(first, expected)
+    # The flipped view of the first buffer isn't written over
+    assert outs[2] is not outs[3]
+    assert np.array_equal(pipeline.run(image + 1), expected + 1)
+    # Buffers are reused by the next run
+    assert outs[4] is outs[2] and outs[5] is outs[3]
+    assert first is outs[5]
+
+    # Results from map are copied out of the buffers
+    results = list(pipeline.map(make_frames(), workers=2))
+    assert [result[0, 0] for result in results] == list(range(2, 22))
+
+
+def test_pickle_pipeline():
+    pipeline = make_pipeline()
+    pipeline.enable_cache()
+    pipeline.reuse_buffers = True
+    pipeline.run(make_frames(1)[0])
+
+    copied = pickle.loads(pickle.dumps(pipeline))
+    assert copied.cache is None
+    assert copied.labels == pipeline.labels
+    assert copied.run(make_frames(2)[1])[0, 0] == 2
@@ -3,9 +3,16 @@ import sys, os
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../')
 
+import asyncio
+import operator
+
+import cv2
 import jowr
+import numpy as np
 import pytest
 import random
+import time
+import zipfile
 
 
 # Test opening camera - open, not connected, closed
@@ -54,3 +61,293 @@ def test_independant_frame_access():
                                           r2):
             assert frame1[0, 0, 0] == i1
             assert frame2[0, 0, 0] == i2
+
+
+def test_prefetch_frames():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    video = jowr.Video(video_file)
+    with video.open_frames(prefetch=4) as frames:
+        values = [frame[0, 0, 0] for frame in frames]
+    assert values == list(range(255))
+
+
+def test_prefetch_stop_early():
+    video_file = 'data/videos/gray_sweep.avi'
+
+    video = jowr.Video(video_file)
+    with video.open_frames(prefetch=4) as frames:
+        for index, frame in enumerate(frames):
+            assert frame[0, 0, 0] == index
+            if index == 10:
+                break
+        # Random access stops the prefetch thread, iteration resumes it
+        assert frames[100][0, 0, 0] == 100
+        assert next(frames)[0, 0, 0] == 11
+    assert frames._prefetcher is None
+
+
+def test_seek_index(tmpdir):
+    video_file = 'data/videos/gray_sweep.avi'
+    cache_dir = str(tmpdir)
+
+    index = jowr.SeekIndex.cached(video_file, cache_dir)
+    # Every frame of an MJPEG video is a keyframe
+    assert index.keyframes == list(range(255))
+    assert index.keyframe_before(100) == 100
+    index_file = jowr.SeekIndex.index_path(video_file, cache_dir)
+    assert os.path.isfile(index_file)
+    assert jowr.SeekIndex.load(index_file).keyframes == index.keyframes
+
+    video = jowr.Video(video_file, seek_index=True, cache_dir=cache_dir)
+    assert video.seek_index.keyframes == index.keyframes
+    with video.open_frames() as frames:
+        for index in (200, 3, 50, 49, 51, 70):
+            assert frames[index][0, 0, 0] == index
+        values = [frame[0, 0, 0] for frame in frames[10:100:7]]
+    assert values == list(range(10, 100, 7))
+
+
+def test_seek_index_keyframe_before():
+    index = jowr.SeekIndex([0, 30, 60])
+    assert index.keyframe_before(0) == 0
+    assert index.keyframe_before(29) == 0
+    assert index.keyframe_before(30) == 30
+    assert index.keyframe_before(1000) == 60
+    assert jowr.SeekIndex([]).keyframe_before(10) is None
+
+
+def test_frame_cache():
+    video_file = 'data/videos/gray_sweep.avi'
+    frame_bytes = 400 * 300 * 3
+
+    video = jowr.Video(video_file, cache_bytes=10 * frame_bytes)
+    with video.open_frames() as frames:
+        for index in (20, 21, 22, 21, 20, 22):
+            assert frames[index][0, 0, 0] == index
+        assert video.cache.hits == 3
+        assert video.cache.misses == 3
+
+        # Only the most recently used frames fit in the budget
+        for frame in frames[100:120]:
+            pass
+        assert len(video.cache) == 10
+        assert video.cache.nbytes == 10 * frame_bytes
+        assert 20 not in video.cache
+        assert frames[119][0, 0, 0] == 119
+        assert video.cache.hits == 4
+
+
+def test_frame_cache_read_only():
+    video_file = 'data/videos/gray_sweep.avi'
+    frame_bytes = 400 * 300 * 3
+
+    video = jowr.Video(video_file, cache_bytes=10 * frame_bytes)
+    with video.open_frames() as frames:
+        # Drawing on frames while iterating doesn't change the cache
+        for frame in frames[0:5]:
+            frame[...] = 255
+        assert frames[2][0, 0, 0] == 2
+        with pytest.raises(ValueError):
+            frames[2][...] = 255
+
+
+def test_read_batch():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    video = jowr.Video(video_file)
+    batch = video.read_batch(10, 50, 4)
+    assert batch.shape == (10, 300, 400, 3)
+    assert list(batch[:, 0, 0, 0]) == list(range(10, 50, 4))
+
+    out = np.zeros((5, 300, 400, 3), np.uint8)
+    with video.open():
+        result = video.read_batch(250, out=out)
+    assert result is out
+    assert list(out[:, 0, 0, 0]) == list(range(250, 255))
+
+    with pytest.raises(ValueError):
+        video.read_batch(0, 3, out=out)
+
+
+def test_reuse_buffers():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    video = jowr.Video(video_file)
+    with video.open_frames(buffers=3) as frames:
+        held = [next(frames) for _ in range(3)]
+        assert [frame[0, 0, 0] for frame in held] == [0, 1, 2]
+        # The fourth frame is decoded into the buffer of the first
+        assert next(frames) is held[0]
+        assert held[0][0, 0, 0] == 3
+
+    with video.open_frames(prefetch=2, buffers=5) as frames:
+        assert [frame[0, 0, 0] for frame in frames] == list(range(255))
+
+    with pytest.raises(ValueError):
+        with video.open_frames(prefetch=2, buffers=3):
+            pass
+
+
+def test_frame_store(tmpdir):
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+    store_file = str(tmpdir.join('frames.jowr'))
+
+    video = jowr.Video(video_file)
+    with video.open_frames() as frames:
+        store = jowr.FrameStore.create(store_file, frames[10:60:5])
+
+    store = jowr.FrameStore(store_file)
+    assert len(store) == 10
+    assert store.resolution == video.resolution
+    frame = store.get_frame(3)
+    assert frame[0, 0, 0] == 25
+    assert not frame.flags.writeable
+    with store.open_frames() as frames:
+        assert [frame[0, 0, 0] for frame in frames] == list(range(10, 60, 5))
+        assert frames[9][0, 0, 0] == 55
+
+    with pytest.raises(IndexError):
+        store.get_frame(10)
+
+    # A whole video can be stored directly
+    store = jowr.FrameStore.create(store_file, video)
+    assert len(store) == len(video)
+
+
+def test_parallel_map():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    first_pixel = operator.itemgetter((0, 0, 0))
+
+    video = jowr.Video(video_file)
+    values = video.parallel_map(first_pixel, workers=2, shard_size=20)
+    assert list(values) == list(range(255))
+
+    values = video.parallel_map(first_pixel, 5, 100, 3,
+                                workers=2, shard_size=7)
+    assert list(values) == list(range(5, 100, 3))
+
+
+def test_image_sequence(tmpdir):
+    # Name images so that a plain sort would put 10 and 11 before 2
+    for index in range(12):
+        image = np.full((20, 30, 3), index, np.uint8)
+        cv2.imwrite(str(tmpdir.join('frame{}.png'.format(index))), image)
+
+    sequence = jowr.ImageSequence(str(tmpdir), workers=2, prefetch=3)
+    assert len(sequence) == 12
+    assert sequence.resolution == (30, 20)
+    with sequence.open_frames() as frames:
+        assert [frame[0, 0, 0] for frame in frames] == list(range(12))
+        assert frames[7][0, 0, 0] == 7
+        assert [frame[0, 0, 0] for frame in frames[1:12:3]] == [1, 4, 7, 10]
+
+    # Without opening, images are read on the calling thread
+    assert sequence.get_frame(11)[0, 0, 0] == 11
+    with pytest.raises(IndexError):
+        sequence.get_frame(12)
+
+    pattern = jowr.ImageSequence(str(tmpdir.join('frame1*.png')))
+    assert len(pattern) == 3
+
+
+def test_camera_low_latency(monkeypatch):
+    # Use a video file as a camera which produces frames as fast as possible
+    video_file = 'data/videos/gray_sweep.avi'
+
+    started = []
+
+    class Grabber(jowr.readers._LatestFrameGrabber):
+        def __init__(self, cap):
+            started.append(cap)
+            super().__init__(cap)
+
+    monkeypatch.setattr(jowr.readers, '_LatestFrameGrabber', Grabber)
+    camera = jowr.Camera(video_file, low_latency=True)
+    # Creating the camera doesn't start reading from it
+    assert not started
+    values = []
+    with camera.open_frames() as frames:
+        for frame in frames:
+            values.append(frame[0, 0, 0])
+            assert camera.frame_age >= 0
+            time.sleep(0.001)
+        dropped = camera.dropped_frames
+
+    assert values == sorted(set(values))
+    assert len(values) + dropped == 255
+    assert camera.grabber is None
+    assert len(started) == 1
+
+
+def test_aframes():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    async def first_pixels(reader, **kwargs):
+        return [frame[0, 0, 0]
+                async for frame in reader.aframes(read_ahead=3, **kwargs)]
+
+    async def read_both():
+        return await asyncio.gather(first_pixels(jowr.Video(video_file)),
+                                    first_pixels(jowr.Video(video_file),
+                                                 prefetch=2))
+
+    for values in asyncio.run(read_both()):
+        assert values == list(range(255))
+
+
+def test_multi_capture():
+    # Each frame in the video is a solid gray with value = frame number
+    video_file = 'data/videos/gray_sweep.avi'
+
+    rig = jowr.MultiCapture([jowr.Video(video_file), jowr.Video(video_file)])
+    count = 0
+    with rig.open_frames() as frame_sets:
+        for (left, right), timestamps in frame_sets:
+            assert left[0, 0, 0] == count
+            assert right[0, 0, 0] == count
+            assert len(timestamps) == 2
+            count += 1
+    assert count == 255
+
+    # Stopping early shuts down the reading threads
+    with rig.open_frames() as frame_sets:
+        frame_set = next(frame_sets)
+    assert frame_set.frames[0][0, 0, 0] == 0
+    assert not any(thread.is_alive() for thread in frame_sets.threads)
+
+
+def test_zip_images():
+    zip_filename = 'data/example_cal/test.zip'
+    with zipfile.ZipFile(zip_filename) as zip_file:
+        members = sorted(name for name in zip_file.namelist()
+                         if name.endswith('.png'))
+        expected = [cv2.imdecode(np.frombuffer(zip_file.read(name), np.uint8),
+                                 cv2.IMREAD_COLOR)
+                    for name in members]
+
+    images = jowr.ZipImages(zip_filename, workers=2)
+    assert len(images) == len(members)
+    assert images.resolution == jowr.resolution(expected[0])
+    with images.open_frames() as frames:
+        for image, expected_image in zip(frames, expected):
+            assert np.array_equal(image, expected_image)
+        assert np.array_equal(frames[1], expected[1])
+    # The zip file is only open while reading
+    assert images.zip_file is None
+    assert np.array_equal(images.get_frame(2), expected[2])
+
+
+def test_zip_images_bad_image(tmpdir):
+    zip_filename = str(tmpdir.join('bad.zip'))
+    with zipfile.ZipFile(zip_filename, 'w') as zip_file:
+        zip_file.writestr('image.png', b'not an image')
+    with pytest.raises(IOError):
+        jowr.ZipImages(zip_filename)
@@ -0,0 +1,37 @@
+import sys, os
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+import queue
+
+import jowr
+import numpy as np
+import pytest
+
+
+def test_shared_frame_pool():
+    with jowr.SharedFramePool((4, 5, 3), np.uint8, slots=2) as pool:
+        frame = np.arange(60, dtype=np.uint8).reshape(4, 5, 3)
+        first = pool.put(frame)
+        second, slot_frame = pool.acquire()
+        slot_frame[...] = 7
+        assert first.slot != second.slot
+
+        # Attached frames share memory with the pool
+        attached = jowr.attach(first)
+        assert np.array_equal(attached, frame)
+        attached[0, 0, 0] = 100
+        assert pool.view(first)[0, 0, 0] == 100
+        assert np.all(jowr.attach(second) == 7)
+
+        # All slots are in use until one is released
+        with pytest.raises(queue.Empty):
+            pool.acquire(timeout=0.01)
+        pool.release(first)
+        assert pool.acquire(timeout=0.01)[0].slot == first.slot
+        name = pool.name
+
+    # The memory is removed when the pool is closed
+    with pytest.raises(FileNotFoundError):
+        jowr.shared_memory.SharedMemory(name=name)
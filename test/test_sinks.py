@@ -0,0 +1,90 @@
+import sys, os
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+
+import zipfile
+
+import cv2
+import jowr
+import numpy as np
+import pytest
+
+
+def make_frames(count=10):
+    return [np.full((30, 40, 3), 10 * index, np.uint8)
+            for index in range(count)]
+
+
+def test_video_sink(tmpdir):
+    video_file = str(tmpdir.join('out.avi'))
+    with jowr.VideoSink(video_file, fps=10) as sink:
+        for frame in make_frames():
+            sink.write(frame)
+    assert sink.frames_written == 10
+
+    video = jowr.Video(video_file)
+    assert video.resolution == (40, 30)
+    with video.open_frames() as frames:
+        values = [frame[0, 0, 0] for frame in frames]
+    assert np.allclose(values, range(0, 100, 10), atol=3)
+
+
+def test_image_sequence_sink(tmpdir):
+    folder = str(tmpdir.join('images'))
+    with jowr.ImageSequenceSink(folder) as sink:
+        for frame in make_frames():
+            sink.write(frame)
+
+    sequence = jowr.ImageSequence(folder)
+    assert sequence.filenames[0].endswith('frame000000.png')
+    with sequence.open_frames() as frames:
+        assert [frame[0, 0, 0] for frame in frames] == list(range(0, 100, 10))
+
+
+def test_zip_sink(tmpdir):
+    zip_name = str(tmpdir.join('images.zip'))
+    with jowr.ZipSink(zip_name, pattern='{:03d}.png') as sink:
+        for frame in make_frames(3):
+            sink.write(frame)
+    with zipfile.ZipFile(zip_name) as zip_file:
+        assert zip_file.namelist() == ['000.png', '001.png', '002.png']
+
+
+def test_sink_error(tmpdir):
+    sink = jowr.ZipSink(str(tmpdir.join('images.zip')), pattern='{}.nope')
+    sink.write(make_frames(1)[0])
+    with pytest.raises(cv2.error):
+        sink.close()
+
+
+def test_pipeline_write(tmpdir):
+    video_file = str(tmpdir.join('out.avi'))
+    pipeline = jowr.Pipeline()
+    pipeline.add_step(lambda image: 255 - image, 'invert')
+
+    video = jowr.Video('data/videos/gray_sweep.avi')
+    with video.open_frames(prefetch=4) as frames:
+        count = pipeline.write(frames, jowr.VideoSink(video_file))
+    assert count == len(video)
+    assert len(jowr.Video(video_file)) == len(video)
+
+
+def test_zip_sink_names(tmpdir):
+    zip_name = str(tmpdir.join('captures.zip'))
+    frames = make_frames(3)
+    for _ in range(2):
+        # Adding to the same zip never overwrites earlier images
+        with jowr.ZipSink(zip_name, compression=zipfile.ZIP_DEFLATED) as sink:
+            for frame in frames:
+                sink.write(frame)
+    with jowr.ZipSink(zip_name, pattern='frame.png') as sink:
+        sink.write(frames[0])
+        sink.write(frames[1])
+
+    with zipfile.ZipFile(zip_name) as zip_file:
+        names = zip_file.namelist()
+        assert zip_file.getinfo(names[0]).compress_type == \
+            zipfile.ZIP_DEFLATED
+    assert len(names) == len(set(names)) == 8
+    assert names[-2:] == ['frame.png', 'frame-1.png']